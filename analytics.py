@@ -0,0 +1,457 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from archive import archive
+from database import read_session
+from grading import GRADE_POINTS, get_at_risk_threshold
+from importer import IN_CLAUSE_SIZE, _chunks, grades_imported
+from models import db, Student, Course, Grade, Department, Term, get_data_version
+
+logger = logging.getLogger(__name__)
+
+ENGINE_MODES = ('sql', 'memory', 'compare')
+
+# Letters are stored as category codes; unknown letters become -1 and score 0 points
+LETTER_DTYPE = pd.CategoricalDtype(list(GRADE_POINTS))
+LETTER_POINTS = np.array([GRADE_POINTS[letter] for letter in LETTER_DTYPE.categories] + [0.0])
+
+# Which filters each report honours: department of the student or of the course, course, term
+REPORT_FILTERS = {
+    'grade_distribution': ('student_department', 'course', 'term'),
+    'department_performance': ('term',),
+    'course_comparison': ('course_department', 'term'),
+    'term_trends': ('student_department', 'course'),
+    'student_performance': ('student_department', 'course', 'term'),
+    'at_risk_students': ('student_department', 'term')
+}
+
+GRADE_COLUMNS = {
+    'id': np.int32,
+    'student_pk': np.int32,
+    'course_pk': np.int32,
+    'term_id': np.int32,
+    # Kept in float64 so averages compared against thresholds match the SQL AVG()
+    'grade': np.float64,
+    'student_department': np.int32
+}
+
+
+def _empty_grades():
+    frame = pd.DataFrame({column: np.array([], dtype=dtype) for column, dtype in GRADE_COLUMNS.items()})
+    frame['letter'] = pd.Categorical([], dtype=LETTER_DTYPE)
+    frame['date_added'] = pd.Series([], dtype='datetime64[ns]')
+    return frame
+
+
+# Filters honoured by a plain grade slice: the student's department, course and term
+SLICE_FILTERS = ('student_department', 'course', 'term')
+
+
+def filter_grades(grades, honoured, department_id=None, course_id=None, term_id=None):
+    """Apply the honoured filters (see REPORT_FILTERS) to a grade frame"""
+    mask = np.ones(len(grades), dtype=bool)
+    if department_id and 'student_department' in honoured:
+        mask &= grades['student_department'].to_numpy() == department_id
+    if department_id and 'course_department' in honoured:
+        mask &= grades['course_department'].to_numpy() == department_id
+    if course_id and 'course' in honoured:
+        mask &= grades['course_pk'].to_numpy() == course_id
+    if term_id and 'term' in honoured:
+        mask &= grades['term_id'].to_numpy() == term_id
+    return grades[mask] if not mask.all() else grades
+
+
+def grade_points(grades):
+    """Grade points of every row, looked up from the letter category codes"""
+    return LETTER_POINTS[grades['letter'].cat.codes.to_numpy()]
+
+
+def student_gpas(grades):
+    """Credit-weighted GPA per student primary key over every grade in the frame"""
+    credits = grades['credits'].to_numpy(dtype=np.float64)
+    frame = pd.DataFrame({
+        'student_pk': grades['student_pk'].to_numpy(),
+        'points': grade_points(grades) * credits,
+        'credits': credits
+    })
+    totals = frame.groupby('student_pk')[['points', 'credits']].sum()
+    gpas = (totals['points'] / totals['credits'].where(totals['credits'] != 0)).round(2)
+    return gpas.fillna(0.0)
+
+
+def _averages(grades, key):
+    """Mean grade (accumulated in float64) and row count per key"""
+    frame = pd.DataFrame({key: grades[key].to_numpy(), 'grade': grades['grade'].to_numpy(dtype=np.float64)})
+    stats = frame.groupby(key, sort=True)['grade'].agg(['sum', 'count'])
+    stats['average_grade'] = (stats['sum'] / stats['count']).round(2)
+    return stats
+
+
+def report_frame(report_type, grades, dimensions, all_grades=None, gpas=None, at_risk_threshold=None):
+    """Build a report DataFrame from an already filtered grade frame
+
+    dimensions maps 'students', 'courses', 'departments' and 'terms' to
+    frames indexed by primary key. Student GPAs come from gpas (a Series by
+    student primary key) when given, else from all_grades, the unfiltered
+    frame, which defaults to grades. The columns match utils.generate_report.
+    """
+    students, courses = dimensions['students'], dimensions['courses']
+    departments, terms = dimensions['departments'], dimensions['terms']
+
+    if report_type == 'grade_distribution':
+        counts = grades['letter'].value_counts(sort=False)
+        counts = counts[counts > 0]
+        df = pd.DataFrame({'letter_grade': counts.index.astype(str), 'count': counts.to_numpy()})
+        return df.sort_values('letter_grade').reset_index(drop=True)
+
+    elif report_type == 'department_performance':
+        stats = _averages(grades, 'student_department')
+        student_counts = grades.groupby('student_department')['student_pk'].nunique()
+        df = pd.DataFrame({
+            'department': departments['name'].reindex(stats.index).to_numpy(),
+            'average_grade': stats['average_grade'].to_numpy(),
+            'student_count': student_counts.reindex(stats.index).to_numpy()
+        })
+        return df.sort_values('department').reset_index(drop=True)
+
+    elif report_type == 'course_comparison':
+        stats = _averages(grades, 'course_pk')
+        rows = courses.reindex(stats.index)
+        return pd.DataFrame({
+            'course_code': rows['code'].to_numpy(),
+            'course_name': rows['name'].to_numpy(),
+            'average_grade': stats['average_grade'].to_numpy(),
+            'enrollment': stats['count'].to_numpy()
+        })
+
+    elif report_type == 'term_trends':
+        stats = _averages(grades, 'term_id')
+        return pd.DataFrame({
+            'term': terms['name'].reindex(stats.index).to_numpy(),
+            'average_grade': stats['average_grade'].to_numpy()
+        })
+
+    elif report_type in ('student_performance', 'at_risk_students'):
+        stats = _averages(grades, 'student_pk')
+        if report_type == 'at_risk_students':
+            if at_risk_threshold is None:
+                at_risk_threshold = get_at_risk_threshold()
+            stats = stats[stats['sum'] / stats['count'] < at_risk_threshold]
+        rows = students.reindex(stats.index)
+        df = pd.DataFrame({
+            'student_id': rows['student_id'].to_numpy(),
+            'first_name': rows['first_name'].to_numpy(),
+            'last_name': rows['last_name'].to_numpy(),
+            'department': departments['name'].reindex(rows['department_id']).to_numpy(),
+            'average_grade': stats['average_grade'].to_numpy()
+        })
+        df['full_name'] = df['first_name'] + ' ' + df['last_name']
+        if gpas is None:
+            gpas = student_gpas(all_grades if all_grades is not None else grades)
+        df['gpa'] = gpas.reindex(stats.index).fillna(0.0).to_numpy()
+        return df
+
+    return None
+
+
+def frames_match(expected, actual, tolerance=0.011):
+    """Compare two report frames ignoring row order and float summation-order noise"""
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+        return False
+    keys = [column for column in expected.columns if not pd.api.types.is_float_dtype(expected[column])]
+    expected = expected.sort_values(keys or list(expected.columns)).reset_index(drop=True)
+    actual = actual.sort_values(keys or list(actual.columns)).reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_exact=False,
+                                      atol=tolerance, rtol=0)
+    except AssertionError:
+        return False
+    return True
+
+
+def load_dimensions(session, student_pks=None, students=True):
+    """Load the lookup frames reports need, indexed by primary key
+
+    Pass student_pks to load only those students instead of the whole
+    table, or students=False to skip them.
+    """
+    student_query = session.query(
+        Student.id, Student.student_id, Student.first_name, Student.last_name, Student.department_id
+    )
+    if not students:
+        student_rows = []
+    elif student_pks is None:
+        student_rows = student_query.all()
+    else:
+        student_rows = []
+        for batch in _chunks([int(pk) for pk in student_pks], IN_CLAUSE_SIZE):
+            student_rows.extend(student_query.filter(Student.id.in_(batch)).all())
+    student_frame = pd.DataFrame(student_rows, columns=['id', 'student_id', 'first_name', 'last_name',
+                                                        'department_id'])
+    courses = pd.DataFrame(session.query(
+        Course.id, Course.code, Course.name, Course.credits, Course.department_id
+    ).all(), columns=['id', 'code', 'name', 'credits', 'department_id'])
+    departments = pd.DataFrame(session.query(Department.id, Department.name).all(), columns=['id', 'name'])
+    terms = pd.DataFrame(session.query(Term.id, Term.name).all(), columns=['id', 'name'])
+
+    student_frame['department_id'] = student_frame['department_id'].astype(np.int32)
+    courses['department_id'] = courses['department_id'].fillna(0).astype(np.int32)
+    courses['credits'] = courses['credits'].astype(np.float32)
+    return {
+        'students': student_frame.set_index(student_frame['id'].astype(np.int32)),
+        'courses': courses.set_index(courses['id'].astype(np.int32)),
+        'departments': departments.set_index(departments['id'].astype(np.int32)),
+        'terms': terms.set_index(terms['id'].astype(np.int32))
+    }
+
+
+def load_grades(session, condition=None, dates=True, batch_size=50000):
+    """Load grade rows matching condition into compact columns
+
+    The student's department is joined in; date_added is kept unless dates
+    is False.
+    """
+    columns = [Grade.id, Grade.student_id, Grade.course_id, Grade.term_id,
+               Grade.numeric_grade, Student.department_id, Grade.letter_grade]
+    if dates:
+        columns.append(Grade.date_added)
+    stmt = db.select(*columns).join(Student, Student.id == Grade.student_id)
+    if condition is not None:
+        stmt = stmt.where(condition)
+
+    # Plain Core rows skip ORM row processing; each batch is converted to
+    # compact columns straight away so the raw rows never pile up
+    frames = []
+    result = session.connection().execute(stmt.execution_options(yield_per=batch_size))
+    try:
+        for rows in result.partitions():
+            values = list(zip(*rows))
+            frame = pd.DataFrame({
+                name: np.asarray(column, dtype=dtype)
+                for (name, dtype), column in zip(GRADE_COLUMNS.items(), values)
+            })
+            frame['letter'] = pd.Categorical(values[6], dtype=LETTER_DTYPE)
+            if dates:
+                frame['date_added'] = pd.to_datetime(pd.Series(values[7]))
+            frames.append(frame)
+    finally:
+        result.close()
+
+    if not frames:
+        grades = _empty_grades()
+        return grades if dates else grades.drop(columns='date_added')
+    return pd.concat(frames, ignore_index=True)
+
+
+def archived_grades(term_id=None):
+    """Grades of archived terms (see archive.py) in the compact columns of load_grades, or None"""
+    grades = archive.grades(term_id)
+    if grades is None:
+        return None
+    return grades.astype({**GRADE_COLUMNS, 'letter': LETTER_DTYPE})
+
+
+def attach_dimensions(grades, dimensions):
+    """Add the course's department and credits to each grade row"""
+    course_rows = dimensions['courses'].reindex(grades['course_pk'])
+    return grades.assign(
+        course_department=course_rows['department_id'].fillna(0).to_numpy(dtype=np.int32),
+        credits=course_rows['credits'].fillna(0).to_numpy(dtype=np.float32)
+    )
+
+
+def grade_slice(department_id=None, course_id=None, term_id=None, honoured=SLICE_FILTERS, students=True):
+    """Return (grades, dimensions) for the grades matching the honoured filters
+
+    The slice comes from the analytics engine when it is enabled, otherwise
+    it is fetched from the database in one query and from the archived term
+    snapshots. Student lookups are limited to the students in the slice, and
+    skipped when students is False.
+    """
+    if analytics.enabled:
+        grades, dimensions = analytics.snapshot()
+        return filter_grades(grades, honoured, department_id, course_id, term_id), dimensions
+
+    session = read_session()
+    conditions = []
+    if department_id and 'student_department' in honoured:
+        conditions.append(Student.department_id == department_id)
+    if department_id and 'course_department' in honoured:
+        conditions.append(Grade.course_id.in_(
+            db.select(Course.id).where(Course.department_id == department_id)
+        ))
+    if course_id and 'course' in honoured:
+        conditions.append(Grade.course_id == course_id)
+    if term_id and 'term' in honoured:
+        conditions.append(Grade.term_id == term_id)
+
+    grades = load_grades(session, db.and_(*conditions) if conditions else None, dates=False)
+    archived = archived_grades(term_id if 'term' in honoured else None)
+    if archived is not None:
+        archived = filter_grades(archived, set(honoured) - {'course_department'}, department_id, course_id, term_id)
+        grades = pd.concat([archived, grades], ignore_index=True)
+    dimensions = load_dimensions(session, grades['student_pk'].unique(), students)
+    grades = attach_dimensions(grades, dimensions)
+    if archived is not None and department_id and 'course_department' in honoured:
+        grades = filter_grades(grades, ('course_department',), department_id)
+    return grades, dimensions
+
+
+class AnalyticsEngine:
+    """In-memory columnar copy of the grade data for answering reports
+
+    ANALYTICS_ENGINE selects 'sql' (reports query the database), 'memory'
+    (reports are computed from NumPy/pandas columns held by each worker) or
+    'compare' (the SQL result is served and the in-memory result is checked
+    against it). The columns are loaded lazily and refreshed incrementally
+    after imports: new and re-imported grades are found through the id and
+    date_added watermarks, and a row count mismatch triggers a full reload.
+    Grades of archived terms are appended from their snapshots.
+    """
+
+    def __init__(self, app=None):
+        self.mode = 'sql'
+        self.version_check_seconds = 1.0
+        self.overlap = timedelta(seconds=300)
+        self._lock = threading.Lock()
+        self._grades = None
+        self._live = None
+        self._dimensions = None
+        self._version = None
+        self._version_checked = 0.0
+        self._max_id = 0
+        self._watermark = None
+        self.refreshes = 0
+        self.full_loads = 0
+        self.comparisons = 0
+        self.mismatches = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ANALYTICS_ENGINE', 'sql')
+        app.config.setdefault('ANALYTICS_REFRESH_OVERLAP_SECONDS', 300)
+        app.config.setdefault('DATA_VERSION_CHECK_SECONDS', 1.0)
+        if app.config['ANALYTICS_ENGINE'] not in ENGINE_MODES:
+            raise ValueError(f'Unknown ANALYTICS_ENGINE: {app.config["ANALYTICS_ENGINE"]}')
+        self.mode = app.config['ANALYTICS_ENGINE']
+        self.version_check_seconds = app.config['DATA_VERSION_CHECK_SECONDS']
+        self.overlap = timedelta(seconds=app.config['ANALYTICS_REFRESH_OVERLAP_SECONDS'])
+        grades_imported.connect(self._on_grades_imported, weak=False)
+        app.extensions['analytics'] = self
+
+    @property
+    def enabled(self):
+        return self.mode != 'sql'
+
+    def _on_grades_imported(self, sender, **extra):
+        with self._lock:
+            self._version_checked = 0.0
+
+    def snapshot(self):
+        """Return the current (grades, dimensions) frames, refreshing them if the data changed"""
+        now = time.monotonic()
+        with self._lock:
+            if self._grades is not None and now - self._version_checked < self.version_check_seconds:
+                return self._grades, self._dimensions
+            version = get_data_version()
+            if self._grades is None or version != self._version:
+                self._refresh()
+                self._version = version
+            self._version_checked = now
+            return self._grades, self._dimensions
+
+    def _refresh(self):
+        session = read_session()
+        dimensions = load_dimensions(session)
+
+        if self._live is None:
+            grades = self._track_watermarks(attach_dimensions(load_grades(session), dimensions))
+            self.full_loads += 1
+        else:
+            condition = Grade.id > self._max_id
+            if self._watermark is not None:
+                # Re-imported grades get a new date_added; the overlap covers imports still committing
+                condition = db.or_(condition, Grade.date_added >= self._watermark - self.overlap)
+            fresh = self._track_watermarks(attach_dimensions(load_grades(session, condition), dimensions))
+            grades = self._live
+            if len(fresh):
+                grades = grades[~grades['id'].isin(fresh['id'])]
+                grades = pd.concat([grades, fresh], ignore_index=True)
+
+            if len(grades) != session.query(db.func.count(Grade.id)).scalar():
+                # Rows were deleted behind our back, e.g. by archiving a term
+                grades = self._track_watermarks(attach_dimensions(load_grades(session), dimensions))
+                self.full_loads += 1
+
+        self._live = grades
+        archived = archived_grades()
+        if archived is not None:
+            grades = pd.concat([attach_dimensions(archived, dimensions), grades], ignore_index=True)
+        self._grades = grades
+        self._dimensions = dimensions
+        self.refreshes += 1
+
+    def _track_watermarks(self, fresh):
+        """Advance the id and date_added watermarks past freshly loaded rows"""
+        if len(fresh):
+            self._max_id = max(self._max_id, int(fresh['id'].max()))
+            latest = fresh['date_added'].max()
+            if pd.notna(latest) and (self._watermark is None or latest > self._watermark):
+                self._watermark = latest.to_pydatetime()
+        return fresh.drop(columns='date_added')
+
+    def report(self, report_type, department_id=None, course_id=None, term_id=None):
+        """Compute a report from the in-memory columns"""
+        if report_type not in REPORT_FILTERS:
+            return None
+        grades, dimensions = self.snapshot()
+        selected = filter_grades(grades, REPORT_FILTERS[report_type], department_id, course_id, term_id)
+        return report_frame(report_type, selected, dimensions, all_grades=grades)
+
+    def run(self, report_type, sql_report, department_id=None, course_id=None, term_id=None):
+        """Answer a report according to the engine mode
+
+        sql_report computes the report through the database and is used in
+        'sql' and 'compare' modes.
+        """
+        if self.mode == 'sql':
+            return sql_report()
+        if self.mode == 'memory':
+            return self.report(report_type, department_id, course_id, term_id)
+
+        expected = sql_report()
+        actual = self.report(report_type, department_id, course_id, term_id)
+        matched = frames_match(expected, actual)
+        with self._lock:
+            self.comparisons += 1
+            if not matched:
+                self.mismatches += 1
+        if not matched:
+            logger.warning('Analytics engine mismatch for %s (department=%s, course=%s, term=%s)',
+                           report_type, department_id, course_id, term_id)
+        return expected
+
+    def stats(self):
+        with self._lock:
+            grades = self._grades
+            return {
+                'mode': self.mode,
+                'rows': len(grades) if grades is not None else 0,
+                'bytes': int(grades.memory_usage(deep=True).sum()) if grades is not None else 0,
+                'data_version': self._version,
+                'refreshes': self.refreshes,
+                'full_loads': self.full_loads,
+                'comparisons': self.comparisons,
+                'mismatches': self.mismatches
+            }
+
+
+analytics = AnalyticsEngine()
@@ -1,39 +1,82 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import io
-import base64
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
 from flask_wtf.csrf import CSRFProtect
 import secrets
+from dotenv import load_dotenv
 import json
-from models import db, User, Course, Student, Grade, Department, Term
+import itertools
+import click
+from models import db, User, Course, Student, Grade, Department, Term, ImportJob, bump_data_version
 from forms import LoginForm, UploadForm, ReportForm
-from utils import allowed_file, generate_report, calculate_statistics
+from database import database_config, init_database
+from grading import parse_scale
+from utils import allowed_file, get_report, get_reports, get_dashboard_data, list_students, scan_report_query, REPORT_COLUMNS
+from migrations import upgrade_schema, pending_upgrades, count_duplicate_grades, check_query_plans
+from cache import cache, report_cache, response_cache
+from analytics import analytics
+from charts import charts, CHART_COLORS
+from grade_stats import grade_statistics, parse_bins, parse_group_by, parse_percentiles
+from exports import EXPORT_FORMATS, stream_report
+from jobs import JobQueue
+from instrumentation import instrumentation
+from events import events
+from archive import archive
+from summaries import course_letter_distributions, rebuild_summaries, summaries_missing
+from standings import at_risk_count, at_risk_students, declining_students, rebuild_standings, standings_missing
+
+# Load settings from a .env file when present
+load_dotenv()
 
 # Initialize Flask application
 app = Flask(__name__)
 app.config['SECRET_KEY'] = secrets.token_hex(16)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///grades.db'
+app.config.update(database_config())
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+# Uploads are streamed to disk and imported in chunks, so the limit only bounds disk use
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 4096)) * 1024 * 1024
+app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+app.config['VALIDATION_WORKERS'] = int(os.environ.get('VALIDATION_WORKERS', os.cpu_count() or 1))
+app.config['IMPORT_INCREMENTAL'] = os.environ.get('IMPORT_INCREMENTAL', '1') == '1'
+app.config['TERM_ARCHIVE_DIR'] = os.environ.get('TERM_ARCHIVE_DIR', os.path.join(app.instance_path, 'term_archive'))
+# Parsed here so an invalid scale stops the app at startup rather than failing every import
+app.config['GRADING_SCALE'] = parse_scale(os.environ.get('GRADING_SCALE', 'standard'))
+app.config['AT_RISK_THRESHOLD'] = float(os.environ.get('AT_RISK_THRESHOLD', 70))
+app.config['AT_RISK_DECLINE'] = float(os.environ.get('AT_RISK_DECLINE', 10))
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'memory')
+app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+app.config['ANALYTICS_ENGINE'] = os.environ.get('ANALYTICS_ENGINE', 'sql')
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['EVENTS_MAX_CLIENTS'] = int(os.environ.get('EVENTS_MAX_CLIENTS', 8))
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize extensions
 csrf = CSRFProtect(app)
-db.init_app(app)
+init_database(app)
+instrumentation.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+job_queue = JobQueue(app)
+cache.init_app(app)
+report_cache.init_app(app)
+response_cache.init_app(app)
+events.init_app(app)
+charts.init_app(app)
+analytics.init_app(app)
+archive.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -65,37 +108,30 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get basic statistics for dashboard
-    total_students = Student.query.count()
-    total_courses = Course.query.count()
-    recent_grades = Grade.query.order_by(Grade.date_added.desc()).limit(5).all()
-    
-    # Create summary statistics
-    stats = calculate_statistics()
-    
-    # Get department distribution for chart
-    dept_data = db.session.query(Department.name, db.func.count(Student.id))\
-        .join(Student, Student.department_id == Department.id)\
-        .group_by(Department.name).all()
-    
-    # Grade distribution data
-    grade_distribution = db.session.query(Grade.letter_grade, db.func.count(Grade.id))\
-        .group_by(Grade.letter_grade).all()
+    data = get_dashboard_data()
     
     return render_template('dashboard.html', 
-                          total_students=total_students,
-                          total_courses=total_courses,
-                          recent_grades=recent_grades,
-                          stats=stats,
-                          dept_data=json.dumps([x[0] for x in dept_data]),
-                          dept_counts=json.dumps([x[1] for x in dept_data]),
-                          grade_labels=json.dumps([x[0] for x in grade_distribution]),
-                          grade_counts=json.dumps([x[1] for x in grade_distribution]))
+                          total_students=data['total_students'],
+                          total_courses=data['total_courses'],
+                          recent_grades=data['recent_grades'],
+                          stats=data['stats'],
+                          dept_data=json.dumps(data['dept_labels']),
+                          dept_counts=json.dumps(data['dept_counts']),
+                          grade_labels=json.dumps(data['grade_labels']),
+                          grade_counts=json.dumps(data['grade_counts']))
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    return events.stream()
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
     form = UploadForm()
+    # Archived terms no longer accept grades
+    open_terms = Term.query.filter(Term.archived_at.is_(None)).all()
+    form.term.choices = [(t.id, t.name) for t in open_terms]
     if form.validate_on_submit():
         if 'file' not in request.files:
             flash('No file part', 'danger')
@@ -108,33 +144,21 @@ def upload():
             
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            # Prefix stored files so concurrent uploads with the same name don't collide
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'{secrets.token_hex(8)}_{filename}')
             file.save(filepath)
             
-            try:
-                # Process the uploaded file
-                if filename.endswith('.csv'):
-                    df = pd.read_csv(filepath)
-                elif filename.endswith(('.xls', '.xlsx')):
-                    df = pd.read_excel(filepath)
-                else:
-                    flash('Unsupported file format', 'danger')
-                    return redirect(request.url)
-                
-                # Import data to database
-                term_id = form.term.data
-                import_count = import_grade_data(df, term_id)
-                
-                flash(f'Successfully imported {import_count} grade records', 'success')
-                return redirect(url_for('dashboard'))
+            # Import in the background and let the client poll for progress
+            job = job_queue.enqueue(filepath, filename, form.term.data, current_user.id)
             
-            except Exception as e:
-                flash(f'Error processing file: {str(e)}', 'danger')
-                return redirect(request.url)
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify(job.to_dict()), 202
+            
+            flash(f'Import queued as job #{job.id}', 'success')
+            return redirect(url_for('dashboard'))
     
     # Get terms for dropdown
-    terms = Term.query.all()
-    return render_template('upload.html', form=form, terms=terms)
+    return render_template('upload.html', form=form, terms=open_terms)
 
 @app.route('/reports', methods=['GET', 'POST'])
 @login_required
@@ -151,32 +175,80 @@ def reports():
         course_id = form.course.data if form.course.data else None
         term_id = form.term.data if form.term.data else None
         
-        # Generate the report
-        report_data = generate_report(report_type, department_id, course_id, term_id)
+        # Downloads stream rows from the database as they are encoded
+        if form.format.data in EXPORT_FORMATS:
+            try:
+                chunks = stream_report(form.format.data, report_type, department_id, course_id, term_id,
+                                       app.config['EXPORT_BATCH_SIZE'])
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(request.url)
+            
+            mimetype, extension = EXPORT_FORMATS[form.format.data]
+            filename = f'report_{report_type}_{datetime.now().strftime("%Y%m%d")}.{extension}'
+            return app.response_class(
+                stream_with_context(chunks),
+                mimetype=mimetype,
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
+        
+        # Generate the report, reusing a cached copy while the data is unchanged
+        report_data = get_report(report_type, department_id, course_id, term_id)
         
-        if report_data:
-            # For downloadable reports
-            if form.format.data == 'csv':
-                output = io.StringIO()
-                report_data.to_csv(output, index=False)
-                output.seek(0)
-                
-                return send_file(
-                    io.BytesIO(output.getvalue().encode()),
-                    mimetype='text/csv',
-                    as_attachment=True,
-                    download_name=f'report_{report_type}_{datetime.now().strftime("%Y%m%d")}.csv'
-                )
+        if report_data is not None:
+            # For visualization, charts are fetched from their own cacheable endpoints
+            visualization = chart_data = None
+            if charts.supports(report_type):
+                params = dict(report_type=report_type, department_id=department_id,
+                              course_id=course_id, term_id=term_id)
+                visualization = url_for('chart_image', **params)
+                chart_data = url_for('chart_series', **params)
             
-            # For visualization
             return render_template('report_results.html', 
                                   report_type=report_type,
                                   tables=[report_data.to_html(classes='table table-striped')],
                                   titles=report_data.columns.values,
-                                  visualization=create_visualization(report_data, report_type))
+                                  visualization=visualization,
+                                  chart_data=chart_data)
     
     return render_template('reports.html', form=form)
 
+def _chart_report(report_type):
+    """Look up the (cached) report behind a chart request"""
+    if not charts.supports(report_type):
+        return None
+    return get_report(report_type,
+                      request.args.get('department_id', type=int),
+                      request.args.get('course_id', type=int),
+                      request.args.get('term_id', type=int))
+
+@app.route('/charts/<report_type>.png')
+@login_required
+def chart_image(report_type):
+    data = _chart_report(report_type)
+    if data is None:
+        return jsonify({'error': 'No chart for this report type'}), 404
+    
+    png, data_hash = charts.render_png(data, report_type)
+    response = app.response_class(png, mimetype='image/png')
+    response.set_etag(data_hash)
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
+@app.route('/charts/<report_type>.json')
+@login_required
+def chart_series(report_type):
+    data = _chart_report(report_type)
+    if data is None:
+        return jsonify({'error': 'No chart for this report type'}), 404
+    
+    response = jsonify(charts.series(data, report_type))
+    response.set_etag(charts.data_hash(data, report_type))
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
 @app.route('/courses')
 @login_required
 def courses():
@@ -186,9 +258,56 @@ def courses():
 @app.route('/students')
 @login_required
 def students():
-    page = request.args.get('page', 1, type=int)
-    students = Student.query.paginate(page=page, per_page=20)
-    return render_template('students.html', students=students)
+    try:
+        page = list_students(after=request.args.get('after'),
+                             department_id=request.args.get('department_id', type=int),
+                             search=request.args.get('q'))
+    except ValueError:
+        return redirect(url_for('students'))
+    return render_template('students.html', students=page['students'], next_cursor=page['next_cursor'])
+
+@app.route('/api/students')
+@login_required
+def api_students():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    try:
+        page = list_students(after=request.args.get('after'),
+                             limit=max(limit, 1),
+                             department_id=request.args.get('department_id', type=int),
+                             search=request.args.get('q'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+# Students returned by one at-risk or declining list request
+MAX_STANDING_STUDENTS = 1000
+
+@app.route('/api/students/at_risk')
+@login_required
+def api_at_risk_students():
+    threshold = request.args.get('threshold', type=float)
+    department_id = request.args.get('department_id', type=int)
+    term_id = request.args.get('term_id', type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_STANDING_STUDENTS)
+    return jsonify({
+        'threshold': threshold if threshold is not None else app.config['AT_RISK_THRESHOLD'],
+        'count': at_risk_count(threshold, department_id, term_id),
+        'students': at_risk_students(threshold, department_id, term_id, limit)
+    })
+
+@app.route('/api/students/declining')
+@login_required
+def api_declining_students():
+    min_drop = request.args.get('min_drop', type=float)
+    department_id = request.args.get('department_id', type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_STANDING_STUDENTS)
+    return jsonify({
+        'min_drop': min_drop if min_drop is not None else app.config['AT_RISK_DECLINE'],
+        'students': declining_students(min_drop, department_id, limit)
+    })
+
+# Courses accepted by one multi-course distribution request
+MAX_DISTRIBUTION_COURSES = 100
 
 @app.route('/api/grade_distribution')
 @login_required
@@ -196,148 +315,207 @@ def api_grade_distribution():
     course_id = request.args.get('course_id', type=int)
     term_id = request.args.get('term_id', type=int)
     
-    query = db.session.query(Grade.letter_grade, db.func.count(Grade.id))
-    
-    if course_id:
-        query = query.filter(Grade.course_id == course_id)
-    if term_id:
-        query = query.filter(Grade.term_id == term_id)
+    def build():
+        distribution = list(get_report('grade_distribution', None, course_id, term_id).itertuples(index=False))
         
-    distribution = query.group_by(Grade.letter_grade).all()
+        # Format for Chart.js
+        return {
+            'labels': [grade[0] for grade in distribution],
+            'datasets': [{
+                'label': 'Grade Distribution',
+                'data': [int(grade[1]) for grade in distribution],
+                'backgroundColor': CHART_COLORS
+            }]
+        }
     
-    # Format for Chart.js
-    labels = [grade[0] for grade in distribution]
-    data = [grade[1] for grade in distribution]
-    
-    return jsonify({
-        'labels': labels,
-        'datasets': [{
-            'label': 'Grade Distribution',
-            'data': data,
-            'backgroundColor': [
-                '#4CAF50', '#8BC34A', '#CDDC39', '#FFEB3B', '#FFC107', '#FF9800', '#FF5722'
-            ]
-        }]
-    })
+    return response_cache.json_response(('grade_distribution', course_id, term_id), build)
 
-def import_grade_data(df, term_id):
-    """Import grades from DataFrame to database"""
-    count = 0
-    for _, row in df.iterrows():
-        try:
-            # Check if student exists, create if not
-            student = Student.query.filter_by(student_id=row['student_id']).first()
-            if not student:
-                # Get or create department
-                dept = Department.query.filter_by(name=row['department']).first()
-                if not dept:
-                    dept = Department(name=row['department'])
-                    db.session.add(dept)
-                    db.session.flush()
-                
-                student = Student(
-                    student_id=row['student_id'],
-                    first_name=row['first_name'],
-                    last_name=row['last_name'],
-                    email=row['email'] if 'email' in row else f"{row['student_id']}@university.edu",
-                    department_id=dept.id
-                )
-                db.session.add(student)
-                db.session.flush()
-            
-            # Check if course exists, create if not
-            course = Course.query.filter_by(code=row['course_code']).first()
-            if not course:
-                course = Course(
-                    code=row['course_code'],
-                    name=row['course_name'] if 'course_name' in row else row['course_code'],
-                    credits=row['credits'] if 'credits' in row else 3
-                )
-                db.session.add(course)
-                db.session.flush()
-            
-            # Add grade
-            grade = Grade(
-                student_id=student.id,
-                course_id=course.id,
-                term_id=term_id,
-                numeric_grade=float(row['grade']),
-                letter_grade=calculate_letter_grade(float(row['grade'])),
-                date_added=datetime.now()
-            )
-            db.session.add(grade)
-            count += 1
+@app.route('/api/grade_distribution/courses')
+@login_required
+def api_course_grade_distributions():
+    course_ids = sorted(set(request.args.getlist('course_id', type=int)))
+    term_id = request.args.get('term_id', type=int)
+    if not course_ids:
+        return jsonify({'error': 'At least one course_id is required'}), 400
+    if len(course_ids) > MAX_DISTRIBUTION_COURSES:
+        return jsonify({'error': f'At most {MAX_DISTRIBUTION_COURSES} courses per request'}), 400
+    
+    def build():
+        courses = db.session.query(Course.id, Course.code)\
+            .filter(Course.id.in_(course_ids)).order_by(Course.code).all()
+        distributions = course_letter_distributions([course.id for course in courses], term_id)
+        labels = sorted({letter for rows in distributions.values() for letter, _ in rows})
         
-        except Exception as e:
-            print(f"Error importing row: {e}")
-            continue
+        # One Chart.js dataset per course over the same letter labels
+        datasets = []
+        for position, course in enumerate(courses):
+            counts = dict(distributions[course.id])
+            datasets.append({
+                'label': course.code,
+                'course_id': course.id,
+                'data': [int(counts.get(letter, 0)) for letter in labels],
+                'backgroundColor': CHART_COLORS[position % len(CHART_COLORS)]
+            })
+        return {'labels': labels, 'datasets': datasets}
     
+    return response_cache.json_response(('course_grade_distributions', tuple(course_ids), term_id), build)
+
+@app.route('/api/reports/batch', methods=['POST'])
+# Session-authenticated JSON API: cross-site forms can't send application/json
+@csrf.exempt
+@login_required
+def api_reports_batch():
+    payload = request.get_json(silent=True) or {}
+    report_types = payload.get('report_types')
+    if not report_types or not isinstance(report_types, list):
+        return jsonify({'error': 'report_types must be a non-empty list'}), 400
+
+    try:
+        reports = get_reports(list(dict.fromkeys(report_types)),
+                              payload.get('department_id') or None,
+                              payload.get('course_id') or None,
+                              payload.get('term_id') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'reports': {
+        report_type: df.astype(object).where(df.notna(), None).to_dict('records')
+        for report_type, df in reports.items()
+    }})
+
+@app.route('/api/statistics')
+@login_required
+def api_statistics():
+    department_id = request.args.get('department_id', type=int)
+    course_id = request.args.get('course_id', type=int)
+    term_id = request.args.get('term_id', type=int)
+    pass_mark = request.args.get('pass_mark', type=float)
+
+    try:
+        group_bys = parse_group_by(request.args.getlist('group_by'))
+        percentiles = parse_percentiles(request.args.get('percentiles'))
+        bins = parse_bins(request.args.get('bins'))
+        key = f'statistics:{group_bys}:{department_id}:{course_id}:{term_id}:{percentiles}:{bins}:{pass_mark}'
+        result = cache.get_or_set(key, lambda: grade_statistics(
+            group_bys, department_id, course_id, term_id, percentiles, bins, pass_mark
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(result)
+
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    return jsonify({'cache': cache.stats(), 'reports': report_cache.stats(), 'responses': response_cache.stats(),
+                    'analytics': analytics.stats(), 'archive': archive.stats()})
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    data = job.to_dict()
+    if os.path.exists(job_queue.error_report_path(job.id)):
+        data['errors_url'] = url_for('api_job_errors', job_id=job.id)
+    return jsonify(data)
+
+@app.route('/api/jobs/<int:job_id>/errors')
+@login_required
+def api_job_errors(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    path = job_queue.error_report_path(job.id)
+    if not os.path.exists(path):
+        return jsonify({'error': 'No validation errors recorded for this job'}), 404
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=f'import_job_{job.id}_errors.csv')
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Recompute the grade summary tables from the grade table"""
+    rebuild_summaries()
+    # Other workers drop their cached results once they see the new version
+    bump_data_version()
     db.session.commit()
-    return count
-
-def calculate_letter_grade(numeric_grade):
-    """Convert numeric grade to letter grade"""
-    if numeric_grade >= 90:
-        return 'A'
-    elif numeric_grade >= 80:
-        return 'B'
-    elif numeric_grade >= 70:
-        return 'C'
-    elif numeric_grade >= 60:
-        return 'D'
-    else:
-        return 'F'
+    print('Grade summaries rebuilt')
 
-def create_visualization(data, report_type):
-    """Create visualization based on report type and data"""
-    plt.figure(figsize=(10, 6))
-    
-    if report_type == 'grade_distribution':
-        sns.barplot(x='letter_grade', y='count', data=data)
-        plt.title('Grade Distribution')
-        plt.xlabel('Grade')
-        plt.ylabel('Count')
-    
-    elif report_type == 'department_performance':
-        sns.barplot(x='department', y='average_grade', data=data)
-        plt.title('Average Grade by Department')
-        plt.xlabel('Department')
-        plt.ylabel('Average Grade')
-        plt.xticks(rotation=45)
-    
-    elif report_type == 'course_trend':
-        sns.lineplot(x='term', y='average_grade', data=data)
-        plt.title('Course Performance Trend')
-        plt.xlabel('Term')
-        plt.ylabel('Average Grade')
-        plt.xticks(rotation=45)
-    
-    # Save plot to a temporary buffer
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    
-    # Convert to base64 for embedding in HTML
-    image_png = buffer.getvalue()
-    buffer.close()
-    encoded = base64.b64encode(image_png)
+@app.cli.command('archive-term')
+@click.argument('term_id', type=int)
+def archive_term_command(term_id):
+    """Move the grades of a closed term into a read-only snapshot"""
+    try:
+        result = archive.archive_term(term_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Archived {result['rows']} grades of term {term_id} to {result['path']} ({result['bytes']} bytes)")
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create columns and indexes added to the models since the database was created
+
+    Building the unique grade index first deletes all but the newest grade of
+    each (student, course, term); back up the database before running this.
+    """
+    created, duplicates_removed = upgrade_schema()
+    if duplicates_removed:
+        print(f'Removed {duplicates_removed} duplicate grades')
+    print(f"Created columns and indexes: {', '.join(created) if created else 'none'}")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any report query scans a hot table without an index"""
+    queries = {}
+    for report_type in REPORT_COLUMNS:
+        for department_id, course_id, term_id in itertools.product((None, 1), repeat=3):
+            name = f'{report_type}(department={department_id}, course={course_id}, term={term_id})'
+            queries[name] = scan_report_query(report_type, department_id, course_id, term_id)
     
-    return 'data:image/png;base64,' + encoded.decode('utf-8')
+    failures = check_query_plans(queries)
+    for name, plan in failures.items():
+        print(name)
+        for detail in plan:
+            print(f'    {detail}')
+    if failures:
+        raise SystemExit(1)
+    print(f'All {len(queries)} report queries use indexes')
 
 with app.app_context():
     db.create_all()
     
-    # Create admin user if it doesn't exist
-    admin = User.query.filter_by(email='admin@university.edu').first()
-    if not admin:
-        admin = User(
-            name='Admin',
-            email='admin@university.edu',
-            password=generate_password_hash('adminpass'),
-            role='admin'
-        )
-        db.session.add(admin)
-        db.session.commit()
+    # Schema changes delete duplicate grades, so they are left to `flask upgrade-db`;
+    # until it runs, skip the startup steps that read the outdated tables
+    pending = pending_upgrades()
+    if pending:
+        app.logger.warning('Database schema is out of date (missing %s); run `flask upgrade-db`', ', '.join(pending))
+        if 'uq_grade_student_course_term' in pending:
+            duplicates = count_duplicate_grades()
+            if duplicates:
+                app.logger.warning('%s duplicate grades will be removed by `flask upgrade-db`; back up the database first',
+                                   duplicates)
+    else:
+        # Create admin user if it doesn't exist
+        admin = User.query.filter_by(email='admin@university.edu').first()
+        if not admin:
+            admin = User(
+                name='Admin',
+                email='admin@university.edu',
+                password=generate_password_hash('adminpass'),
+                role='admin'
+            )
+            db.session.add(admin)
+            db.session.commit()
+        
+        job_queue.recover_stale_jobs()
+        
+        # Databases created before the summary tables existed need one full build
+        if summaries_missing():
+            rebuild_summaries()
+        elif standings_missing():
+            rebuild_standings()
+            db.session.commit()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
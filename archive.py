@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from database import read_session
+from grading import GRADE_POINTS
+from models import db, Grade, Student, Term, GradeSummary, GradeLetterSummary, bump_data_version
+
+# Columns of a term snapshot and their on-disk types; the term id is implied by the snapshot
+ARCHIVE_COLUMNS = {
+    'id': np.int32,
+    'student_pk': np.int32,
+    'course_pk': np.int32,
+    'grade': np.float64,
+    'student_department': np.int32,
+    'letter': np.int8
+}
+AGGREGATES_FILE = 'aggregates.json'
+SUMMARY_FIELDS = ['scope', 'key_id', 'count', 'total', 'total_squares', 'credits', 'weighted_points']
+LETTER_SUMMARY_FIELDS = ['scope', 'key_id', 'letter_grade', 'count']
+
+
+class TermArchive:
+    """Immutable columnar snapshots of closed terms
+
+    archive_term writes every grade of a closed term to one .npy file per
+    column plus an aggregates.json holding the term's summary rows, then
+    removes the grades from the grade table. The summary rows stay in place,
+    so summary-backed reports are unchanged, and rebuild_summaries folds the
+    stored aggregates back in. Reports that need individual grades read the
+    snapshots memory-mapped; loaded snapshots are kept per process since they
+    never change.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._frames = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TERM_ARCHIVE_DIR', os.path.join(app.instance_path, 'term_archive'))
+        self.app = app
+        app.extensions['archive'] = self
+
+    def path(self, term_id):
+        return os.path.join(self.app.config['TERM_ARCHIVE_DIR'], f'term_{term_id}')
+
+    def archived_term_ids(self, session=None):
+        """Ids of the archived terms, oldest archive first"""
+        session = session or read_session()
+        return [term_id for term_id, in session.query(Term.id)
+                .filter(Term.archived_at.isnot(None)).order_by(Term.archived_at, Term.id).all()]
+
+    def covers(self, term_id=None):
+        """Whether grades in scope (one term, or all terms) live in snapshots"""
+        if term_id:
+            return term_id in self.archived_term_ids()
+        return bool(self.archived_term_ids())
+
+    def archive_term(self, term_id):
+        """Freeze a closed term into a snapshot and drop its rows from the grade table"""
+        term = db.session.get(Term, term_id)
+        if term is None:
+            raise ValueError(f'Term {term_id} not found')
+        if term.archived_at is not None:
+            raise ValueError(f'Term {term.name} is already archived')
+        if term.is_active:
+            raise ValueError(f'Term {term.name} is active; close it before archiving')
+
+        grades = self._term_grades(term_id)
+        aggregates = {
+            'term_id': term.id,
+            'term_name': term.name,
+            'rows': len(grades),
+            'archived_at': datetime.utcnow().isoformat(),
+            'letters': list(GRADE_POINTS),
+            'summaries': [dict(zip(SUMMARY_FIELDS, row)) for row in db.session.query(
+                GradeSummary.scope, GradeSummary.key_id, GradeSummary.count, GradeSummary.total,
+                GradeSummary.total_squares, GradeSummary.credits, GradeSummary.weighted_points
+            ).filter(GradeSummary.term_id == term_id).all()],
+            'letter_summaries': [dict(zip(LETTER_SUMMARY_FIELDS, row)) for row in db.session.query(
+                GradeLetterSummary.scope, GradeLetterSummary.key_id,
+                GradeLetterSummary.letter_grade, GradeLetterSummary.count
+            ).filter(GradeLetterSummary.term_id == term_id).all()]
+        }
+
+        # Written next to the final directory and renamed, so a snapshot is either complete or absent
+        path = self.path(term_id)
+        staging = f'{path}.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for column, dtype in ARCHIVE_COLUMNS.items():
+            np.save(os.path.join(staging, f'{column}.npy'), grades[column].to_numpy(dtype=dtype))
+        with open(os.path.join(staging, AGGREGATES_FILE), 'w') as handle:
+            json.dump(aggregates, handle)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(staging, path)
+
+        try:
+            Grade.query.filter(Grade.term_id == term_id).delete(synchronize_session=False)
+            term.archived_at = datetime.utcnow()
+            bump_data_version()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        return {
+            'term_id': term.id,
+            'rows': len(grades),
+            'bytes': sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)),
+            'path': path
+        }
+
+    def _term_grades(self, term_id):
+        rows = db.session.query(
+            Grade.id, Grade.student_id, Grade.course_id, Grade.numeric_grade,
+            Student.department_id, Grade.letter_grade
+        ).join(Student, Student.id == Grade.student_id)\
+         .filter(Grade.term_id == term_id).order_by(Grade.id).all()
+        grades = pd.DataFrame(rows, columns=['id', 'student_pk', 'course_pk', 'grade',
+                                             'student_department', 'letter_grade'])
+        grades['student_department'] = grades['student_department'].fillna(0)
+        grades['letter'] = pd.Categorical(grades['letter_grade'], categories=list(GRADE_POINTS)).codes
+        return grades
+
+    def aggregates(self, term_id):
+        with open(os.path.join(self.path(term_id), AGGREGATES_FILE)) as handle:
+            return json.load(handle)
+
+    def load(self, term_id):
+        """Grade frame of one archived term, its columns memory-mapped from the snapshot"""
+        with self._lock:
+            frame = self._frames.get(term_id)
+        if frame is not None:
+            return frame
+
+        path = self.path(term_id)
+        aggregates = self.aggregates(term_id)
+        columns = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+                   for column in ARCHIVE_COLUMNS}
+        letters = pd.Categorical.from_codes(np.asarray(columns.pop('letter')), categories=aggregates['letters'])
+        frame = pd.DataFrame({
+            'id': columns['id'],
+            'student_pk': columns['student_pk'],
+            'course_pk': columns['course_pk'],
+            'term_id': np.full(len(letters), term_id, dtype=np.int32),
+            'grade': columns['grade'],
+            'student_department': columns['student_department'],
+            'letter': letters
+        }, copy=False)
+        with self._lock:
+            self._frames[term_id] = frame
+            self.loads += 1
+        return frame
+
+    def grades(self, term_id=None):
+        """Archived grades of one term, or of every archived term, as one frame"""
+        term_ids = self.archived_term_ids()
+        if term_id:
+            term_ids = [term_id] if term_id in term_ids else []
+        frames = [self.load(archived_id) for archived_id in term_ids]
+        if not frames:
+            return None
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def summary_rows(self):
+        """(summary rows, letter summary rows) stored in every snapshot, for rebuild_summaries"""
+        summaries, letters = [], []
+        for term_id in self.archived_term_ids(db.session):
+            aggregates = self.aggregates(term_id)
+            summaries.extend(dict(row, term_id=term_id) for row in aggregates['summaries'])
+            letters.extend(dict(row, term_id=term_id) for row in aggregates['letter_summaries'])
+        return summaries, letters
+
+    def stats(self):
+        with self._lock:
+            return {
+                'terms': len(self._frames),
+                'rows': sum(len(frame) for frame in self._frames.values()),
+                'loads': self.loads
+            }
+
+
+archive = TermArchive()
@@ -0,0 +1,202 @@
+"""Benchmark imports, reports, the dashboard and the JSON API at several scales
+
+Every scale runs in a fresh process against its own SQLite database (a
+temporary file by default, or in memory) loaded from datagen output, and
+the timings of all scales are written to one JSON file:
+
+    python benchmark.py --scales 10000,100000 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import datagen
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _timed(func, repeat, setup=None):
+    """Run func repeat times and summarise the wall time in milliseconds"""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(runs), 3),
+        'median_ms': round(statistics.median(runs), 3),
+        'mean_ms': round(statistics.mean(runs), 3),
+        'runs': repeat
+    }
+
+
+def run_scale(scale, args, workdir):
+    """Load one dataset into a new database in workdir and time every benchmark"""
+    data_dir = os.path.join(args.data_dir, str(scale)) if args.data_dir else os.path.join(workdir, 'data')
+    manifest_path = os.path.join(data_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as handle:
+            manifest = json.load(handle)
+    else:
+        manifest = datagen.generate(data_dir, grades=scale, seed=args.seed)
+
+    # The app configures its database at import time
+    os.environ['DATABASE_URL'] = 'sqlite://' if args.db == 'memory' \
+        else f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    from app import app
+    from cache import cache, report_cache, response_cache
+    from importer import import_grade_file
+    from models import db, Student, Term
+    from utils import calculate_statistics, generate_report, REPORT_COLUMNS
+
+    def clear_caches():
+        cache.clear()
+        report_cache.clear()
+        response_cache.clear()
+
+    results = {'scale': scale, 'grades': manifest['grades'], 'students': manifest['students'], 'db': args.db}
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        imports = []
+        term_ids = []
+        for term in manifest['terms']:
+            term_row = Term(name=term['name'])
+            db.session.add(term_row)
+            db.session.commit()
+            term_ids.append(term_row.id)
+            totals = import_grade_file(os.path.join(data_dir, term['file']), term_row.id,
+                                       app.config['IMPORT_CHUNK_SIZE'])
+            imports.append({'term': term['name'], 'rows': totals['imported'], 'seconds': totals['seconds'],
+                            'rows_per_sec': totals['rows_per_sec'], 'stages': totals['timings']})
+        total_seconds = sum(item['seconds'] for item in imports)
+        results['import'] = {
+            'terms': imports,
+            'seconds': round(total_seconds, 3),
+            'rows_per_sec': round(manifest['grades'] / total_seconds, 1) if total_seconds else 0.0
+        }
+
+        # Re-imports: the same file, a copy with 1% of the grades corrected, and a full rewrite
+        first_file = os.path.join(data_dir, manifest['terms'][0]['file'])
+        corrected_file = os.path.join(workdir, 'corrected.csv')
+        corrected = pd.read_csv(first_file, dtype={'student_id': str, 'course_code': str})
+        changed = corrected.sample(frac=0.01, random_state=args.seed).index
+        corrected.loc[changed, 'grade'] = (100 - corrected.loc[changed, 'grade']).round(1)
+        corrected.to_csv(corrected_file, index=False)
+        results['reimport'] = {}
+        for name, path, incremental in (('unchanged', first_file, True), ('corrected', corrected_file, True),
+                                        ('full', first_file, False)):
+            totals = import_grade_file(path, term_ids[0], app.config['IMPORT_CHUNK_SIZE'], incremental=incremental)
+            results['reimport'][name] = {'rows': totals['imported'], 'inserted': totals['inserted'],
+                                         'updated': totals['updated'], 'skipped': totals['skipped'],
+                                         'seconds': totals['seconds'], 'rows_per_sec': totals['rows_per_sec']}
+
+        results['calculate_statistics'] = _timed(calculate_statistics, args.repeat, clear_caches)
+        results['reports'] = {}
+        for report_type in REPORT_COLUMNS:
+            results['reports'][report_type] = {
+                'unfiltered': _timed(lambda: generate_report(report_type), args.repeat),
+                'department_term': _timed(lambda: generate_report(report_type, 1, None, 1), args.repeat)
+            }
+
+        students = [student.id for student in Student.query.order_by(Student.id).limit(100)]
+        results['student_gpa'] = _timed(
+            lambda: [db.session.get(Student, student_id).gpa for student_id in students], args.repeat
+        )
+        results['student_gpa']['students'] = len(students)
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@university.edu', 'password': 'adminpass'})
+    requests = {
+        'dashboard': ('GET', '/dashboard', None),
+        'api_grade_distribution': ('GET', '/api/grade_distribution?term_id=1', None),
+        'api_course_grade_distributions': ('GET', '/api/grade_distribution/courses?course_id=1&course_id=2'
+                                                  '&course_id=3&term_id=1', None),
+        'api_students': ('GET', '/api/students?limit=50', None),
+        'api_statistics': ('GET', '/api/statistics?group_by=department&group_by=term', None),
+        'api_reports_batch': ('POST', '/api/reports/batch', {
+            'report_types': ['grade_distribution', 'course_comparison', 'at_risk_students'],
+            'department_id': 1, 'term_id': 1
+        })
+    }
+    results['http'] = {}
+    for name, (method, url, body) in requests.items():
+        def call():
+            response = client.open(url, method=method, json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f'{method} {url} returned {response.status_code}')
+        results['http'][name] = {
+            'cold': _timed(call, args.repeat, clear_caches),
+            'warm': _timed(call, args.repeat)
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the grade analysis system')
+    parser.add_argument('--scales', default='10000,100000',
+                        help='comma separated grade counts, e.g. 10000,100000,10000000')
+    parser.add_argument('--db', choices=['file', 'memory'], default='file',
+                        help='temporary SQLite file or in-memory SQLite')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='reuse datagen output from <data-dir>/<scale>/ when present')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scale:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{args.run_scale}_')
+        try:
+            results = run_scale(args.run_scale, args, workdir)
+        finally:
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+        with open(args.result_file, 'w', encoding='utf-8') as handle:
+            json.dump(results, handle)
+        return
+
+    results = []
+    for scale in [int(value) for value in args.scales.split(',') if value.strip()]:
+        # A fresh process per scale, since the app binds its database when imported
+        result_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        command = [sys.executable, os.path.abspath(__file__), '--run-scale', str(scale), '--db', args.db,
+                   '--repeat', str(args.repeat), '--seed', str(args.seed), '--result-file', result_file]
+        if args.data_dir:
+            command += ['--data-dir', os.path.abspath(args.data_dir)]
+        print(f'Benchmarking {scale} grades...', file=sys.stderr)
+        try:
+            subprocess.run(command, check=True, cwd=ROOT)
+            with open(result_file, encoding='utf-8') as handle:
+                results.append(json.load(handle))
+        finally:
+            os.unlink(result_file)
+
+    report = {
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
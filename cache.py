@@ -0,0 +1,434 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+from importer import grades_imported
+from models import get_data_version_info
+
+MISSING = object()
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with a TTL per entry"""
+
+    def __init__(self, max_entries=256, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class SQLiteCache:
+    """Cache stored in a SQLite file so every worker on a host shares it"""
+
+    def __init__(self, path, max_entries=1024, default_ttl=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        conn = self._connect()
+        # WAL mode is stored in the database file, so it is set once here
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)')
+
+    def _connect(self):
+        """This thread's connection, opened on first use and reused afterwards"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+        return conn
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache WHERE key = ? AND expires >= ?',
+                               (key, time.time())).fetchone()
+        self._count(row is not None)
+        return pickle.loads(row[0]) if row is not None else MISSING
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.default_ttl if ttl is None else ttl)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires))
+            conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+            # Drop the entries closest to expiry once the table is over capacity
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires '
+                         'LIMIT max(0, (SELECT count(*) FROM cache) - ?))', (self.max_entries,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute('SELECT count(*) FROM cache').fetchone()[0]
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class Cache:
+    """Application cache configured from CACHE_* settings
+
+    CACHE_TYPE selects 'memory' (per worker), 'sqlite' (shared through
+    CACHE_PATH) or 'null' to disable caching. Keys carry the data version, so
+    once any process commits new grades the old entries are never served
+    again, at most DATA_VERSION_CHECK_SECONDS later; this process also drops
+    them right away.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'memory')
+        app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 256)
+        app.config.setdefault('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+
+        cache_type = app.config['CACHE_TYPE']
+        if cache_type == 'memory':
+            self.backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_DEFAULT_TTL'])
+        elif cache_type == 'sqlite':
+            os.makedirs(os.path.dirname(app.config['CACHE_PATH']) or '.', exist_ok=True)
+            self.backend = SQLiteCache(app.config['CACHE_PATH'], app.config['CACHE_MAX_ENTRIES'],
+                                       app.config['CACHE_DEFAULT_TTL'])
+        elif cache_type == 'null':
+            self.backend = None
+        else:
+            raise ValueError(f'Unknown CACHE_TYPE: {cache_type}')
+
+        grades_imported.connect(self._on_grades_imported, weak=False)
+        app.extensions['cache'] = self
+
+    def _on_grades_imported(self, sender, **extra):
+        self.clear()
+
+    def get_or_set(self, key, func, ttl=None):
+        """Return the cached value for key, computing and storing it on a miss"""
+        if self.backend is None:
+            return func()
+        key = f'{report_cache.data_version()}:{key}'
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = func()
+            self.backend.set(key, value, ttl)
+        return value
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        if self.backend is None:
+            return {'backend': 'null'}
+        return self.backend.stats()
+
+
+class ReportCache:
+    """LRU cache of report DataFrames bounded by their total memory footprint
+
+    Entries are keyed by the report parameters plus the data version, so a
+    report computed before an import is never served afterwards. The version
+    is re-read from the database at most every DATA_VERSION_CHECK_SECONDS,
+    and immediately after an import in this process.
+    """
+
+    def __init__(self, app=None):
+        self.max_bytes = 64 * 1024 * 1024
+        self.version_check_seconds = 1.0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._modified = None
+        self._version_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REPORT_CACHE_MAX_MB', 64)
+        app.config.setdefault('DATA_VERSION_CHECK_SECONDS', 1.0)
+        self.max_bytes = int(app.config['REPORT_CACHE_MAX_MB'] * 1024 * 1024)
+        self.version_check_seconds = app.config['DATA_VERSION_CHECK_SECONDS']
+        grades_imported.connect(self._on_grades_imported, weak=False)
+        app.extensions['report_cache'] = self
+
+    def _on_grades_imported(self, sender, **extra):
+        with self._lock:
+            self._version_checked = 0.0
+
+    def data_version(self):
+        """Current data version, refreshed from the database when stale"""
+        return self.data_version_info()[0]
+
+    def data_version_info(self):
+        """(data version, time it last changed), refreshed from the database when stale"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_check_seconds:
+                return self._version, self._modified
+        version, modified = get_data_version_info()
+        with self._lock:
+            if version != self._version:
+                # Reports built from older data can never be requested again
+                self._entries.clear()
+                self._bytes = 0
+            self._version = version
+            self._modified = modified
+            self._version_checked = now
+        return version, modified
+
+    def get(self, params):
+        """Return the cached report for params, or MISSING"""
+        key = (self.data_version(),) + tuple(params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, params, report, version=None):
+        """Store a report built from data at version (the current version by default)"""
+        key = (self.data_version() if version is None else version,) + tuple(params)
+        size = int(report.memory_usage(deep=True).sum()) if report is not None else 0
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (size, report)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_create(self, params, func):
+        """Return the cached report for params, building it with func on a miss"""
+        version = self.data_version()
+        report = self.get(params)
+        if report is MISSING:
+            report = func()
+            self.set(params, report, version)
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'data_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ResponseCache:
+    """Encoded JSON API responses for the current data version
+
+    Payloads are serialized (and gzipped when larger than GZIP_MIN_BYTES)
+    once per data version and served from memory with a weak ETag and
+    Last-Modified taken from the data version, so polling clients that send
+    If-None-Match or If-Modified-Since get a 304 without the payload being
+    rebuilt. Concurrent requests for an entry that is being built wait for
+    it instead of building it again.
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 1024
+        self.gzip_min_bytes = 1024
+        self._entries = OrderedDict()
+        self._building = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.not_modified = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('GZIP_MIN_BYTES', 1024)
+        self.max_entries = app.config['RESPONSE_CACHE_MAX_ENTRIES']
+        self.gzip_min_bytes = app.config['GZIP_MIN_BYTES']
+        app.extensions['response_cache'] = self
+
+    def _encode(self, version, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        compressed = gzip.compress(body, compresslevel=6) if len(body) >= self.gzip_min_bytes else None
+        return f'{version}-{digest}', body, compressed
+
+    def _entry(self, version, key, build):
+        """Return the encoded entry for key, building it at most once at a time"""
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            building = self._building.get(key)
+            if building is None:
+                building = self._building[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            building.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.coalesced += 1
+                    return entry
+            # The builder failed, so build it here
+            return self._encode(version, build())
+
+        try:
+            entry = self._encode(version, build())
+            with self._lock:
+                self.misses += 1
+                if version == self._version:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return entry
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            building.set()
+
+    def json_response(self, key, build):
+        """Answer the current request with the payload build() returns for key"""
+        version, modified = report_cache.data_version_info()
+        etag, body, compressed = self._entry(version, tuple(key), build)
+
+        response = Response(mimetype='application/json')
+        if compressed is not None and 'gzip' in request.accept_encodings:
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.set_data(body)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag, weak=True)
+        if modified is not None:
+            response.last_modified = modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code == 304:
+            with self._lock:
+                self.not_modified += 1
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'data_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'not_modified': self.not_modified
+            }
+
+
+cache = Cache()
+report_cache = ReportCache()
+response_cache = ResponseCache()
@@ -0,0 +1,94 @@
+import hashlib
+import io
+
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+
+from cache import MemoryCache, MISSING
+
+# Report types with a chart: (chart type, x column, y column, title, x label, y label)
+CHARTS = {
+    'grade_distribution': ('bar', 'letter_grade', 'count', 'Grade Distribution', 'Grade', 'Count'),
+    'department_performance': ('bar', 'department', 'average_grade', 'Average Grade by Department',
+                               'Department', 'Average Grade'),
+    'term_trends': ('line', 'term', 'average_grade', 'Performance Trend', 'Term', 'Average Grade')
+}
+
+CHART_COLORS = ['#4CAF50', '#8BC34A', '#CDDC39', '#FFEB3B', '#FFC107', '#FF9800', '#FF5722']
+
+
+class ChartRenderer:
+    """Render report charts off the pyplot state machine, cached by data hash"""
+
+    def __init__(self, app=None):
+        self.images = MemoryCache(max_entries=128, default_ttl=24 * 3600)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CHART_CACHE_ENTRIES', 128)
+        self.images = MemoryCache(max_entries=app.config['CHART_CACHE_ENTRIES'], default_ttl=24 * 3600)
+        app.extensions['charts'] = self
+
+    @staticmethod
+    def supports(report_type):
+        return report_type in CHARTS
+
+    @staticmethod
+    def data_hash(data, report_type):
+        """Stable digest of a report's content, used for cache keys and ETags"""
+        digest = hashlib.sha1(report_type.encode())
+        digest.update('\x1f'.join(map(str, data.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def render_png(self, data, report_type):
+        """Return (png bytes, data hash) for a report, rendering only on a cache miss"""
+        key = self.data_hash(data, report_type)
+        png = self.images.get(key)
+        if png is MISSING:
+            png = self._render(data, report_type)
+            self.images.set(key, png)
+        return png, key
+
+    def _render(self, data, report_type):
+        kind, x, y, title, xlabel, ylabel = CHARTS[report_type]
+        fig = Figure(figsize=(10, 6))
+        try:
+            ax = fig.add_subplot()
+            if kind == 'bar':
+                sns.barplot(x=x, y=y, data=data, ax=ax)
+            else:
+                sns.lineplot(x=x, y=y, data=data, ax=ax)
+            ax.set_title(title)
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+            if report_type != 'grade_distribution':
+                ax.tick_params(axis='x', labelrotation=45)
+            fig.tight_layout()
+
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png')
+            return buffer.getvalue()
+        finally:
+            fig.clear()
+
+    @staticmethod
+    def series(data, report_type):
+        """Chart.js payload for client-side rendering of a report"""
+        kind, x, y, title, _, _ = CHARTS[report_type]
+        return {
+            'type': kind,
+            'labels': [str(label) for label in data[x]],
+            'datasets': [{
+                'label': title,
+                'data': data[y].tolist(),
+                'backgroundColor': CHART_COLORS
+            }]
+        }
+
+
+charts = ChartRenderer()
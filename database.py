@@ -0,0 +1,106 @@
+import os
+
+from flask.globals import app_ctx
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from models import db
+
+_read_session = None
+
+
+def database_config(environ=os.environ):
+    """Build the SQLAlchemy settings from environment variables
+
+    DATABASE_URL selects the database (SQLite by default, PostgreSQL works
+    too), DB_POOL_SIZE/DB_MAX_OVERFLOW/DB_POOL_TIMEOUT size the pool and
+    DB_BUSY_TIMEOUT_MS sets how long SQLite waits on a locked database.
+    READ_DATABASE_URL points report queries at a replica; with SQLite,
+    DB_READ_ONLY_REPORTS=1 opens a read-only connection to the same file.
+    """
+    url = environ.get('DATABASE_URL', 'sqlite:///grades.db')
+    backend = make_url(url).get_backend_name()
+    engine_options = {}
+
+    if backend == 'sqlite':
+        engine_options['connect_args'] = {
+            'timeout': int(environ.get('DB_BUSY_TIMEOUT_MS', 5000)) / 1000,
+            'check_same_thread': False
+        }
+    else:
+        engine_options['pool_pre_ping'] = True
+        engine_options['pool_recycle'] = int(environ.get('DB_POOL_RECYCLE', 1800))
+
+    # In-memory SQLite uses a single shared connection, so there is no pool to size
+    if not (backend == 'sqlite' and make_url(url).database in (None, '', ':memory:')):
+        engine_options['pool_size'] = int(environ.get('DB_POOL_SIZE', 5))
+        engine_options['max_overflow'] = int(environ.get('DB_MAX_OVERFLOW', 10))
+        engine_options['pool_timeout'] = int(environ.get('DB_POOL_TIMEOUT', 30))
+
+    return {
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+        'SQLALCHEMY_READ_DATABASE_URI': environ.get('READ_DATABASE_URL'),
+        'SQLITE_READ_ONLY_REPORTS': environ.get('DB_READ_ONLY_REPORTS', '0') == '1',
+        'SQLITE_PRAGMAS': {
+            'synchronous': environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            'cache_size': -int(environ.get('SQLITE_CACHE_SIZE_KB', 64000)),
+            'mmap_size': int(environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            'temp_store': 'MEMORY'
+        }
+    }
+
+
+def _sqlite_pragma_listener(pragmas, read_only=False):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if read_only:
+                cursor.execute('PRAGMA query_only=ON')
+            else:
+                # WAL lets report reads proceed while an import is writing
+                cursor.execute('PRAGMA journal_mode=WAL')
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_database(app):
+    """Initialise SQLAlchemy for the app and apply the engine profile"""
+    global _read_session
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+        pragmas = app.config.get('SQLITE_PRAGMAS', {})
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _sqlite_pragma_listener(pragmas))
+
+        read_url = app.config.get('SQLALCHEMY_READ_DATABASE_URI')
+        if not read_url and engine.dialect.name == 'sqlite' and app.config.get('SQLITE_READ_ONLY_REPORTS'):
+            read_url = f'sqlite:///file:{engine.url.database}?mode=ro&uri=true'
+        if not read_url:
+            return
+
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        read_engine = create_engine(read_url, **options)
+        if read_engine.dialect.name == 'sqlite':
+            event.listen(read_engine, 'connect', _sqlite_pragma_listener(pragmas, read_only=True))
+
+    # Scope read sessions like db.session: one per app context
+    _read_session = scoped_session(
+        sessionmaker(bind=read_engine),
+        scopefunc=lambda: id(app_ctx._get_current_object())
+    )
+
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        _read_session.remove()
+
+
+def read_session():
+    """Session for report queries: the read-only engine if configured, else db.session"""
+    return _read_session if _read_session is not None else db.session
@@ -0,0 +1,136 @@
+"""Generate a synthetic university dataset as grade CSV files
+
+Each term gets one CSV in the upload format (student_id, names, email,
+department, course_code, course_name, credits, grade) and manifest.json
+describes what was written. Students have a latent ability, courses a
+difficulty and most enrolments fall in the student's own department, so
+averages, distributions and at-risk lists look like real data.
+
+    python datagen.py --grades 1000000 --output data/
+"""
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+FIRST_NAMES = [
+    'Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João',
+    'Larissa', 'Lucas', 'Mariana', 'Mateus', 'Natália', 'Pedro', 'Rafaela', 'Rodrigo', 'Sofia', 'Thiago',
+    'Alice', 'Arthur', 'Beatriz', 'Caio', 'Helena', 'Igor', 'Julia', 'Leonardo', 'Laura', 'Vinícius'
+]
+
+LAST_NAMES = [
+    'Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes',
+    'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes', 'Vieira', 'Barbosa'
+]
+
+DEPARTMENTS = [
+    ('Computer Science', 'CS'), ('Mathematics', 'MAT'), ('Physics', 'PHY'), ('Chemistry', 'CHE'),
+    ('Biology', 'BIO'), ('Economics', 'ECO'), ('History', 'HIS'), ('Literature', 'LIT'),
+    ('Civil Engineering', 'CIV'), ('Electrical Engineering', 'ELE'), ('Law', 'LAW'), ('Medicine', 'MED')
+]
+
+COLUMNS = ['student_id', 'first_name', 'last_name', 'email', 'department',
+           'course_code', 'course_name', 'credits', 'grade']
+
+
+def _departments(count):
+    departments = list(DEPARTMENTS[:count])
+    for number in range(len(departments), count):
+        departments.append((f'Department {number + 1}', f'D{number + 1:02d}'))
+    return departments
+
+
+def generate(output_dir, grades=10000, departments=8, terms=4, courses_per_department=20,
+             courses_per_term=5, seed=0, chunk_students=50000):
+    """Write term grade CSVs with at least `grades` rows in total and return the manifest"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    dept_rows = _departments(departments)
+    student_count = max(1, math.ceil(grades / (terms * courses_per_term)))
+
+    course_dept = np.repeat(np.arange(departments), courses_per_department)
+    course_number = np.tile(np.arange(courses_per_department), departments)
+    course_codes = np.array([f'{dept_rows[d][1]}{100 + n}' for d, n in zip(course_dept, course_number)])
+    course_names = np.array([f'{dept_rows[d][0]} {n + 1}' for d, n in zip(course_dept, course_number)])
+    course_credits = rng.choice([2.0, 3.0, 4.0], size=len(course_codes), p=[0.2, 0.6, 0.2])
+    course_difficulty = rng.normal(0, 5, size=len(course_codes))
+    dept_names = np.array([name for name, _ in dept_rows])
+
+    student_dept = rng.integers(0, departments, size=student_count)
+    ability = rng.normal(72, 10, size=student_count)
+    first = rng.integers(0, len(FIRST_NAMES), size=student_count)
+    last = rng.integers(0, len(LAST_NAMES), size=student_count)
+    first_names = np.array(FIRST_NAMES)[first]
+    last_names = np.array(LAST_NAMES)[last]
+    student_ids = np.array([f'S{number:08d}' for number in range(1, student_count + 1)])
+
+    manifest = {
+        'seed': seed,
+        'students': student_count,
+        'courses': len(course_codes),
+        'departments': [name for name, _ in dept_rows],
+        'terms': [],
+        'grades': 0
+    }
+    take = min(courses_per_term, len(course_codes))
+    for term in range(terms):
+        name = f'{2020 + term // 2}.{term % 2 + 1}'
+        path = os.path.join(output_dir, f'grades_{name}.csv')
+        rows = 0
+        with open(path, 'w', encoding='utf-8', newline='') as handle:
+            for start in range(0, student_count, chunk_students):
+                stop = min(start + chunk_students, student_count)
+                size = stop - start
+                # Random keys biased towards the student's department; the top ones are distinct enrolments
+                keys = rng.random((size, len(course_codes)))
+                keys += 0.6 * (course_dept[None, :] == student_dept[start:stop, None])
+                chosen = np.argpartition(-keys, take - 1, axis=1)[:, :take].ravel()
+                students = np.repeat(np.arange(start, stop), take)
+
+                drift = rng.normal(0, 1.5)
+                values = ability[students] - course_difficulty[chosen] + drift \
+                    + rng.normal(0, 8, size=len(chosen))
+                frame = pd.DataFrame({
+                    'student_id': student_ids[students],
+                    'first_name': first_names[students],
+                    'last_name': last_names[students],
+                    'email': np.char.add(np.char.lower(student_ids[students]), '@university.edu'),
+                    'department': dept_names[student_dept[students]],
+                    'course_code': course_codes[chosen],
+                    'course_name': course_names[chosen],
+                    'credits': course_credits[chosen],
+                    'grade': np.clip(values, 0, 100).round(1)
+                }, columns=COLUMNS)
+                frame.to_csv(handle, index=False, header=start == 0)
+                rows += len(frame)
+        manifest['terms'].append({'name': name, 'file': os.path.basename(path), 'rows': rows})
+        manifest['grades'] += rows
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic university grade dataset')
+    parser.add_argument('--grades', type=int, default=10000, help='minimum number of grade rows')
+    parser.add_argument('--departments', type=int, default=8)
+    parser.add_argument('--terms', type=int, default=4)
+    parser.add_argument('--courses-per-department', type=int, default=20)
+    parser.add_argument('--courses-per-term', type=int, default=5, help='enrolments per student and term')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='data', help='directory for the CSV files and manifest')
+    args = parser.parse_args(argv)
+
+    manifest = generate(args.output, args.grades, args.departments, args.terms,
+                        args.courses_per_department, args.courses_per_term, args.seed)
+    print(f'Wrote {manifest["grades"]} grades for {manifest["students"]} students '
+          f'in {len(manifest["terms"])} terms to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
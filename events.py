@@ -0,0 +1,207 @@
+import json
+import logging
+import queue
+import threading
+
+from flask import Response
+
+from cache import cache
+from importer import grades_imported
+from models import get_data_version
+from utils import dashboard_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_delta(old, new):
+    """Fields of the new dashboard snapshot that differ from the old one
+
+    Nested dicts are compared key by key and keys that disappeared are sent
+    as None, so clients can apply the delta to the state they hold.
+    """
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changed = {name: item for name, item in value.items() if previous.get(name) != item}
+            changed.update({name: None for name in previous if name not in value})
+            if changed:
+                delta[key] = changed
+        elif previous != value:
+            delta[key] = value
+    return delta
+
+
+def _message(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data, separators=(",", ":"))}']
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventBroadcaster:
+    """Server-Sent Events channel pushing dashboard changes after imports
+
+    One watcher thread recomputes the dashboard snapshot when the data
+    version changes, which it notices right away for imports in this
+    process and every EVENTS_POLL_SECONDS for imports committed by other
+    processes. The delta against the previous snapshot is encoded once and
+    queued for every connected client. Clients start with the full snapshot;
+    a client that falls EVENTS_QUEUE_SIZE messages behind is disconnected
+    and gets a fresh snapshot when its EventSource reconnects.
+
+    Every open stream occupies a server thread for as long as the page is
+    open, so deployments need threaded or async workers (e.g. gunicorn
+    -k gthread) with EVENTS_MAX_CLIENTS kept well below the thread count.
+    Setting it to 0 turns streaming off, for sync workers.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._version = None
+        self._snapshot = None
+        self.events_sent = 0
+        self.snapshots = 0
+        self.dropped_clients = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_POLL_SECONDS', 2.0)
+        app.config.setdefault('EVENTS_KEEPALIVE_SECONDS', 15.0)
+        app.config.setdefault('EVENTS_QUEUE_SIZE', 16)
+        app.config.setdefault('EVENTS_MAX_CLIENTS', 8)
+        self.app = app
+        grades_imported.connect(self._on_grades_imported, weak=False)
+        app.extensions['events'] = self
+
+    def _on_grades_imported(self, sender, **extra):
+        self._wake.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watch, name='dashboard-events', daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        while True:
+            self._wake.wait(self.app.config['EVENTS_POLL_SECONDS'])
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                logger.exception('Could not refresh the dashboard snapshot')
+
+    def current(self):
+        """(data version, snapshot), computing the snapshot if there is none yet"""
+        with self._lock:
+            if self._snapshot is not None:
+                return self._version, self._snapshot
+        version = get_data_version()
+        snapshot = dashboard_snapshot()
+        with self._lock:
+            if self._snapshot is None:
+                self._version, self._snapshot = version, snapshot
+                self.snapshots += 1
+            return self._version, self._snapshot
+
+    def refresh(self):
+        """Recompute the snapshot after a data version change and broadcast the delta"""
+        version = get_data_version()
+        with self._lock:
+            if self._snapshot is not None and version == self._version:
+                return None
+            previous = self._snapshot
+        if previous is not None:
+            # Imports in other processes don't clear this process's cache
+            cache.clear()
+        snapshot = dashboard_snapshot()
+        with self._lock:
+            self._version, self._snapshot = version, snapshot
+            self.snapshots += 1
+        if previous is None:
+            return None
+        delta = snapshot_delta(previous, snapshot)
+        if delta:
+            self.publish('dashboard', {'version': version, 'changes': delta}, version)
+        return delta
+
+    def publish(self, event, data, event_id=None):
+        """Queue one encoded message for every connected client"""
+        message = _message(event, data, event_id)
+        with self._lock:
+            clients = list(self._clients)
+            self.events_sent += 1
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients.discard(client)
+            self.dropped_clients += 1
+        with client.mutex:
+            client.queue.clear()
+        client.put_nowait(None)
+
+    def stream(self):
+        """text/event-stream response for one client, or 503 when the client limit is reached"""
+        with self._lock:
+            if len(self._clients) >= self.app.config['EVENTS_MAX_CLIENTS']:
+                return Response('Too many event stream clients', status=503, headers={'Retry-After': '30'})
+            client = queue.Queue(maxsize=self.app.config['EVENTS_QUEUE_SIZE'])
+            self._clients.add(client)
+        try:
+            version, snapshot = self.current()
+        except Exception:
+            with self._lock:
+                self._clients.discard(client)
+            raise
+        self._start()
+        keepalive = self.app.config['EVENTS_KEEPALIVE_SECONDS']
+
+        def close():
+            with self._lock:
+                self._clients.discard(client)
+
+        def generate():
+            try:
+                yield 'retry: 5000\n\n'
+                yield _message('snapshot', {'version': version, 'dashboard': snapshot}, version)
+                while True:
+                    try:
+                        message = client.get(timeout=keepalive)
+                    except queue.Empty:
+                        yield ': keepalive\n\n'
+                        continue
+                    if message is None:
+                        return
+                    yield message
+            finally:
+                close()
+
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # A generator closed before its first item never runs its finally block
+        response.call_on_close(close)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'data_version': self._version,
+                'snapshots': self.snapshots,
+                'events_sent': self.events_sent,
+                'dropped_clients': self.dropped_clients
+            }
+
+
+events = EventBroadcaster()
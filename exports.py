@@ -0,0 +1,161 @@
+import io
+import zlib
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+from utils import get_report, iter_report_batches
+from charts import charts
+
+# Export formats: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv_gzip': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'pdf': ('application/pdf', 'pdf')
+}
+
+# Landscape letter pages with a monospaced table
+PDF_PAGE_SIZE = (11, 8.5)
+PDF_ROWS_PER_PAGE = 45
+
+
+def parquet_available():
+    return pq is not None
+
+
+def _csv_chunks(batches):
+    header = True
+    for batch in batches:
+        yield batch.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _DrainableBuffer(io.RawIOBase):
+    """Write-only sink whose contents are handed out and dropped after each row group or page"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_chunks(batches):
+    sink = _DrainableBuffer()
+    writer = None
+    try:
+        for batch in batches:
+            table = pa.Table.from_pandas(batch, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def _pdf_title_page(report_type, filters, chart_png):
+    fig = Figure(figsize=PDF_PAGE_SIZE)
+    title = report_type.replace('_', ' ').title()
+    fig.text(0.05, 0.94, title, fontsize=20, weight='bold')
+    described = ', '.join(f'{name}: {value}' for name, value in filters.items() if value) or 'none'
+    fig.text(0.05, 0.90, f'Filters: {described}', fontsize=10)
+    fig.text(0.05, 0.87, f'Generated {datetime.now().strftime("%Y-%m-%d %H:%M")}', fontsize=10)
+    if chart_png is not None:
+        ax = fig.add_axes([0.05, 0.05, 0.9, 0.78])
+        ax.imshow(imread(io.BytesIO(chart_png), format='png'))
+        ax.axis('off')
+    return fig
+
+
+def _pdf_table_page(rows, page_number):
+    fig = Figure(figsize=PDF_PAGE_SIZE)
+    fig.text(0.04, 0.96, rows.to_string(index=False, float_format='{:.2f}'.format),
+             family='monospace', fontsize=7, va='top')
+    fig.text(0.96, 0.02, f'Page {page_number}', fontsize=8, ha='right')
+    return fig
+
+
+def _pdf_chunks(report_type, filters, batches):
+    """Write the chart and table one PDF page at a time, yielding bytes as pages are finished"""
+    sink = _DrainableBuffer()
+    chart_png = None
+    if charts.supports(report_type):
+        # Chart reports are small, so the cached report and rendered image are reused
+        chart_png, _ = charts.render_png(get_report(report_type, **filters), report_type)
+
+    with PdfPages(sink) as pdf:
+        pdf.savefig(_pdf_title_page(report_type, filters, chart_png))
+        yield sink.drain()
+
+        page_number = 1
+        pending = None
+        for batch in batches:
+            pending = batch if pending is None else pd.concat([pending, batch], ignore_index=True)
+            while len(pending) >= PDF_ROWS_PER_PAGE:
+                page_number += 1
+                pdf.savefig(_pdf_table_page(pending.iloc[:PDF_ROWS_PER_PAGE], page_number))
+                pending = pending.iloc[PDF_ROWS_PER_PAGE:]
+                yield sink.drain()
+        if pending is not None and (len(pending) or page_number == 1):
+            pdf.savefig(_pdf_table_page(pending, page_number + 1))
+    yield sink.drain()
+
+
+def stream_report(export_format, report_type, department_id=None, course_id=None, term_id=None,
+                  batch_size=5000):
+    """Yield the encoded bytes of a report export one batch at a time"""
+    batches = iter_report_batches(report_type, department_id, course_id, term_id, batch_size)
+    if export_format == 'csv':
+        return _csv_chunks(batches)
+    if export_format == 'csv_gzip':
+        return _gzip_chunks(_csv_chunks(batches))
+    if export_format == 'parquet':
+        if not parquet_available():
+            raise ValueError('Parquet export requires the pyarrow package')
+        return _parquet_chunks(batches)
+    if export_format == 'pdf':
+        filters = {'department_id': department_id, 'course_id': course_id, 'term_id': term_id}
+        return _pdf_chunks(report_type, filters, batches)
+    raise ValueError(f'Unknown export format: {export_format}')
@@ -34,6 +34,8 @@ class ReportForm(FlaskForm):
     format = SelectField('Format', choices=[
         ('web', 'Web View'),
         ('csv', 'CSV Download'),
+        ('csv_gzip', 'Compressed CSV Download (gzip)'),
+        ('parquet', 'Parquet Download'),
         ('pdf', 'PDF Download')
     ], default='web')
     
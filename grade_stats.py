@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from analytics import grade_slice
+from grading import get_scale
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+DEFAULT_BINS = 10
+MAX_BINS = 1000
+
+# Group-by dimensions: (grade frame column, dimension frame, label column)
+GROUP_DIMENSIONS = {
+    'course': ('course_pk', 'courses', 'code'),
+    'department': ('student_department', 'departments', 'name'),
+    'term': ('term_id', 'terms', 'name'),
+    'student': ('student_pk', 'students', 'student_id')
+}
+
+
+def parse_group_by(values):
+    """Turn group_by arguments like ['course', 'department,term'] into key tuples"""
+    group_bys = []
+    for value in values or ['']:
+        keys = tuple(key.strip() for key in value.split(',') if key.strip())
+        unknown = [key for key in keys if key not in GROUP_DIMENSIONS]
+        if unknown:
+            raise ValueError(f'Unknown group_by dimension: {", ".join(unknown)}')
+        group_bys.append(keys)
+    return group_bys
+
+
+def _number(text, name):
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f'{name} must be numbers, got {text.strip()!r}')
+    if not np.isfinite(value):
+        raise ValueError(f'{name} must be finite numbers, got {text.strip()!r}')
+    return value
+
+
+def parse_percentiles(value):
+    """Comma-separated percentiles between 0 and 100, or the defaults when empty"""
+    percentiles = [_number(item, 'percentiles') for item in (value or '').split(',') if item.strip()]
+    out_of_range = [p for p in percentiles if not 0 <= p <= 100]
+    if out_of_range:
+        raise ValueError(f'percentiles must be between 0 and 100, got {out_of_range[0]:g}')
+    return percentiles or list(DEFAULT_PERCENTILES)
+
+
+def parse_bins(value):
+    """A bin count (1 to MAX_BINS) or comma-separated increasing bin edges"""
+    if value is None or not value.strip():
+        return DEFAULT_BINS
+    if ',' in value:
+        edges = [_number(item, 'bin edges') for item in value.split(',') if item.strip()]
+        if len(edges) < 2 or any(low >= high for low, high in zip(edges, edges[1:])):
+            raise ValueError('bin edges must be at least two strictly increasing numbers')
+        return edges
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f'bins must be a bin count or comma-separated edges, got {value.strip()!r}')
+    if not 1 <= count <= MAX_BINS:
+        raise ValueError(f'bins must be between 1 and {MAX_BINS}')
+    return count
+
+
+def histogram_edges(bins):
+    """Bin edges from a bin count over 0-100 or an explicit ascending list of edges"""
+    if isinstance(bins, int):
+        if bins < 1:
+            raise ValueError('bins must be at least 1')
+        return np.linspace(0, 100, bins + 1)
+    edges = np.asarray(sorted(float(edge) for edge in bins))
+    if len(edges) < 2 or len(np.unique(edges)) != len(edges):
+        raise ValueError('bins needs at least two distinct edges')
+    return edges
+
+
+def _rounded(values):
+    """Round to 2 decimals and turn NaN into None for JSON"""
+    return [None if pd.isna(value) else round(float(value), 2) for value in values]
+
+
+def _group_statistics(frame, group_by, dimensions, quantiles, bin_count):
+    keys = [GROUP_DIMENSIONS[key][0] for key in group_by] or ['_all']
+    groups = frame.groupby(keys, sort=True)
+
+    summary = groups['grade'].agg(['count', 'mean', 'std', 'min', 'max'])
+    summary['pass_rate'] = groups['passed'].mean()
+    percentiles = groups['grade'].quantile(quantiles).unstack().reindex(columns=quantiles)
+    binned = frame[frame['bin'] >= 0]
+    histograms = binned.groupby(keys + ['bin']).size().unstack(fill_value=0)\
+        .reindex(index=summary.index, columns=range(bin_count), fill_value=0)
+
+    rows = [{} for _ in range(len(summary))]
+    for key in group_by:
+        column, dimension, label = GROUP_DIMENSIONS[key]
+        ids = summary.index.get_level_values(column)
+        labels = dimensions[dimension][label].reindex(ids)
+        for row, key_id, name in zip(rows, ids.tolist(), labels.tolist()):
+            row[f'{key}_id'] = key_id
+            row[key] = name
+
+    columns = {
+        'count': summary['count'].tolist(),
+        'mean': _rounded(summary['mean']),
+        'median': _rounded(percentiles[0.5]),
+        'std': _rounded(summary['std']),
+        'min': _rounded(summary['min']),
+        'max': _rounded(summary['max']),
+        'pass_rate': _rounded(summary['pass_rate'] * 100)
+    }
+    for name, values in columns.items():
+        for row, value in zip(rows, values):
+            row[name] = value
+    percentile_values = {q: _rounded(percentiles[q]) for q in quantiles}
+    histogram_values = histograms.to_numpy().tolist()
+    for position, row in enumerate(rows):
+        row['percentiles'] = {f'p{q * 100:g}': percentile_values[q][position] for q in quantiles}
+        row['histogram'] = histogram_values[position]
+    return rows
+
+
+def grade_statistics(group_bys=((),), department_id=None, course_id=None, term_id=None,
+                     percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS, pass_mark=None):
+    """Distribution statistics of the filtered grades for each requested grouping
+
+    The grade slice is fetched once and every grouping is computed from it
+    with vectorized groupbys: count, mean, median, standard deviation,
+    min/max, the requested percentiles, a histogram over the bin edges and
+    the share of grades at or above pass_mark (the lowest passing grade of
+    the configured scale by default).
+    """
+    edges = histogram_edges(bins)
+    if pass_mark is None:
+        pass_mark = float(get_scale().cut_points[0])
+    quantiles = sorted({p / 100 for p in percentiles} | {0.5})
+    if any(q < 0 or q > 1 for q in quantiles):
+        raise ValueError('Percentiles must be between 0 and 100')
+
+    grades, dimensions = grade_slice(department_id, course_id, term_id,
+                                     students=any('student' in group_by for group_by in group_bys))
+    values = grades['grade'].to_numpy(dtype=np.float64)
+    # Right-closed last bin, like numpy.histogram; grades outside the edges are not binned
+    bin_index = np.searchsorted(edges, values, side='right') - 1
+    bin_index[values == edges[-1]] = len(edges) - 2
+    bin_index[(values < edges[0]) | (values > edges[-1])] = -1
+
+    frame = pd.DataFrame({
+        column: grades[column].to_numpy() for column, _, _ in GROUP_DIMENSIONS.values()
+    })
+    frame['_all'] = 0
+    frame['grade'] = values
+    frame['passed'] = values >= pass_mark
+    frame['bin'] = bin_index
+
+    return {
+        'filters': {'department_id': department_id, 'course_id': course_id, 'term_id': term_id},
+        'pass_mark': pass_mark,
+        'bin_edges': [float(edge) for edge in edges],
+        'groups': {
+            ','.join(group_by) or 'all': _group_statistics(frame, group_by, dimensions, quantiles, len(edges) - 1)
+            for group_by in group_bys
+        }
+    }
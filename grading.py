@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+
+# Grade points for every letter grade used in GPA calculations
+GRADE_POINTS = {
+    'A+': 4.0, 'A': 4.0, 'A-': 3.7,
+    'B+': 3.3, 'B': 3.0, 'B-': 2.7,
+    'C+': 2.3, 'C': 2.0, 'C-': 1.7,
+    'D+': 1.3, 'D': 1.0, 'D-': 0.7,
+    'F': 0.0
+}
+
+
+class GradingScale:
+    """Map numeric grades to letter grades through a table of cut points
+
+    cut_points holds the ascending lower bounds of each letter above the
+    lowest one, so letters has exactly one more entry than cut_points.
+    """
+
+    def __init__(self, cut_points, letters):
+        if len(letters) != len(cut_points) + 1:
+            raise ValueError('A grading scale needs one more letter than cut points')
+        if list(cut_points) != sorted(cut_points):
+            raise ValueError('Grading scale cut points must be ascending')
+        unknown = set(letters) - set(GRADE_POINTS)
+        if unknown:
+            raise ValueError(f'Unknown letter grades in scale: {sorted(unknown)}')
+        self.cut_points = np.asarray(cut_points, dtype=float)
+        self.letters = np.asarray(letters, dtype=object)
+        self.points = np.asarray([GRADE_POINTS[letter] for letter in letters], dtype=float)
+
+    @classmethod
+    def from_table(cls, table):
+        """Build a scale from (lower_bound, letter) pairs in any order"""
+        rows = sorted(table)
+        if not rows or rows[0][0] > 0:
+            raise ValueError('Grading scale table must start at or below 0')
+        return cls([bound for bound, _ in rows[1:]], [letter for _, letter in rows])
+
+    @property
+    def key(self):
+        """Compact description of the scale, equal for scales that grade alike"""
+        steps = [f'{cut:g}:{letter}' for cut, letter in zip(self.cut_points, self.letters[1:])]
+        return ' '.join([self.letters[0]] + steps)
+
+    def _positions(self, numeric_grades):
+        return np.searchsorted(self.cut_points, np.asarray(numeric_grades, dtype=float), side='right')
+
+    def letter_grades(self, numeric_grades):
+        """Vectorized numeric grade to letter grade conversion"""
+        return self.letters[self._positions(numeric_grades)]
+
+    def grade_points(self, numeric_grades):
+        """Vectorized numeric grade to grade point conversion"""
+        return self.points[self._positions(numeric_grades)]
+
+    def letter_grade(self, numeric_grade):
+        """Convert a single numeric grade to a letter grade"""
+        return self.letter_grades([numeric_grade])[0]
+
+
+STANDARD_SCALE = GradingScale([60, 70, 80, 90], ['F', 'D', 'C', 'B', 'A'])
+
+PLUS_MINUS_SCALE = GradingScale(
+    [60, 63, 67, 70, 73, 77, 80, 83, 87, 90, 93, 97],
+    ['F', 'D-', 'D', 'D+', 'C-', 'C', 'C+', 'B-', 'B', 'B+', 'A-', 'A', 'A+']
+)
+
+SCALES = {
+    'standard': STANDARD_SCALE,
+    'plus_minus': PLUS_MINUS_SCALE
+}
+
+
+def parse_scale(setting):
+    """Return the grading scale a GRADING_SCALE setting describes
+
+    The setting may be a GradingScale, the name of a built-in scale, a
+    'lower_bound:letter' list such as '0:F,60:D,70:C,80:B,90:A', or a
+    sequence of (lower_bound, letter) pairs.
+    """
+    if isinstance(setting, GradingScale):
+        return setting
+    if isinstance(setting, str):
+        if ':' not in setting:
+            if setting not in SCALES:
+                raise ValueError(f'Unknown GRADING_SCALE {setting!r}; expected one of {sorted(SCALES)}')
+            return SCALES[setting]
+        table = []
+        for step in setting.split(','):
+            bound, _, letter = step.partition(':')
+            try:
+                table.append((float(bound), letter.strip()))
+            except ValueError:
+                raise ValueError(f'Invalid GRADING_SCALE step {step.strip()!r}; expected lower_bound:letter')
+        setting = table
+    return GradingScale.from_table(setting)
+
+
+def get_scale():
+    """Return the grading scale configured by GRADING_SCALE (see parse_scale)"""
+    setting = current_app.config.get('GRADING_SCALE', 'standard') if has_app_context() else 'standard'
+    return parse_scale(setting)
+
+
+def get_at_risk_threshold():
+    """Average grade below which a student is at risk, from AT_RISK_THRESHOLD"""
+    return float(current_app.config.get('AT_RISK_THRESHOLD', 70)) if has_app_context() else 70.0
+
+
+def get_decline_threshold():
+    """Drop in term average, in numeric grade (0-100 scale), flagged as a decline (AT_RISK_DECLINE)"""
+    return float(current_app.config.get('AT_RISK_DECLINE', 10)) if has_app_context() else 10.0
+
+
+def letter_grade_points(letter_grades):
+    """Vectorized letter grade to grade point conversion"""
+    return pd.Series(letter_grades, dtype=object).map(GRADE_POINTS).fillna(0.0).to_numpy(dtype=float)
@@ -0,0 +1,444 @@
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from blinker import Namespace
+from flask import current_app
+
+from models import db, Student, Course, Grade, Department, Term, ImportedFile, bump_data_version
+from grading import get_scale
+from summaries import apply_grade_deltas
+from standings import refresh_standings
+from validation import ERROR_COLUMNS, ErrorReport, validate_file, validate_frame
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists below SQLite's bound-parameter limit
+IN_CLAUSE_SIZE = 500
+DEFAULT_CHUNK_SIZE = 5000
+# Fields a student must have before it can be created from an import row
+NEW_STUDENT_COLUMNS = ('first_name', 'last_name', 'department')
+
+signals = Namespace()
+
+# Sent after an import commits new grades, with term_id and count keyword arguments
+grades_imported = signals.signal('grades-imported')
+
+
+class ImportTimer:
+    """Collect wall-clock timings for each import stage"""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _chunks(values, size):
+    """Yield successive slices of a list"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _fetch_map(key_column, value_column, values):
+    """Map key values to another column using batched IN (...) queries"""
+    found = {}
+    for batch in _chunks(list(values), IN_CLAUSE_SIZE):
+        rows = db.session.query(key_column, value_column)\
+            .filter(key_column.in_(batch)).all()
+        found.update(rows)
+    return found
+
+
+def _fetch_ids(model, key_column, values):
+    """Map key values to primary keys using batched IN (...) queries"""
+    return _fetch_map(key_column, model.id, values)
+
+
+def _bulk_insert(model, rows, chunk_size):
+    """Insert plain dict rows with executemany in chunks"""
+    for batch in _chunks(rows, chunk_size):
+        db.session.execute(db.insert(model), batch)
+
+
+def _create_students(frame, student_ids, timer, chunk_size):
+    """Insert students that are not in the database yet
+
+    Returns {student_id: [(column, value, reason), ...]} for the new
+    students that could not be created, whose rows are then rejected.
+    """
+    new = frame[~frame['student_id'].isin(student_ids.keys())]\
+        .drop_duplicates('student_id')
+    rejected = {}
+    incomplete = new[new[list(NEW_STUDENT_COLUMNS)].isna().any(axis=1)]
+    for row in incomplete.itertuples(index=False):
+        rejected[row.student_id] = [(column, '', f'{column} is required for a new student')
+                                    for column in NEW_STUDENT_COLUMNS if pd.isna(getattr(row, column))]
+    new = new.drop(index=incomplete.index)
+    if new.empty:
+        return rejected
+
+    with timer.stage('resolve_departments'):
+        names = new['department'].astype(str).unique().tolist()
+        dept_ids = _fetch_ids(Department, Department.name, names)
+        missing = [{'name': name} for name in names if name not in dept_ids]
+        if missing:
+            _bulk_insert(Department, missing, chunk_size)
+            dept_ids.update(_fetch_ids(Department, Department.name, [m['name'] for m in missing]))
+
+    with timer.stage('insert_students'):
+        # Emails are unique, so skip students whose email is already taken
+        shared = new[new.duplicated('email')]
+        for row in shared.itertuples(index=False):
+            rejected[row.student_id] = [('email', row.email, 'email is used by another new student in the file')]
+        new = new.drop(index=shared.index)
+        taken = _fetch_ids(Student, Student.email, new['email'].astype(str).tolist())
+        for row in new[new['email'].isin(taken.keys())].itertuples(index=False):
+            rejected[row.student_id] = [('email', row.email, 'email is already used by another student')]
+        new = new[~new['email'].isin(taken.keys())]
+        rows = [{
+            'student_id': row.student_id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'email': row.email,
+            'department_id': dept_ids[str(row.department)],
+            'date_enrolled': datetime.utcnow()
+        } for row in new.itertuples(index=False)]
+        _bulk_insert(Student, rows, chunk_size)
+        student_ids.update(_fetch_ids(Student, Student.student_id, new['student_id'].tolist()))
+    return rejected
+
+
+def _rejected_rows(unmapped, reasons):
+    """Error records for rows whose student could not be created, numbered like validation errors"""
+    records = [(row + 2, column, value, message)
+               for row, student_id in zip(unmapped.index, unmapped['student_id'])
+               for column, value, message in reasons.get(student_id, [('student_id', student_id,
+                                                                       'student could not be created')])]
+    return pd.DataFrame(records, columns=ERROR_COLUMNS)
+
+
+def _create_courses(frame, course_ids, chunk_size):
+    """Insert courses that are not in the database yet"""
+    new = frame[~frame['course_code'].isin(course_ids.keys())]\
+        .drop_duplicates('course_code')
+    if new.empty:
+        return
+    rows = [{
+        'code': row.course_code,
+        'name': row.course_name,
+        'credits': float(row.credits)
+    } for row in new.itertuples(index=False)]
+    _bulk_insert(Course, rows, chunk_size)
+    course_ids.update(_fetch_ids(Course, Course.code, new['course_code'].tolist()))
+
+
+def row_fingerprints(frame, term_id):
+    """64-bit hashes of each row's student, course, term, grade and letter"""
+    values = frame[['student_id', 'course_code', 'grade', 'letter']].assign(term_id=term_id)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy().view(np.int64)
+
+
+def _existing_fingerprints(fingerprints, term_id):
+    """The given fingerprints that grades stored in a term already have"""
+    found = set()
+    for batch in _chunks(pd.unique(fingerprints).tolist(), IN_CLAUSE_SIZE):
+        rows = db.session.query(Grade.fingerprint)\
+            .filter(Grade.term_id == term_id, Grade.fingerprint.in_(batch)).all()
+        found.update(fingerprint for fingerprint, in rows)
+    return found
+
+
+def check_term_open(term_id):
+    """Raise ValueError when the term was archived and so no longer accepts grades"""
+    term = db.session.get(Term, term_id)
+    if term is not None and term.archived_at is not None:
+        raise ValueError(f'Term {term.name} is archived and no longer accepts grades')
+
+
+def bulk_import_grades(df, term_id, chunk_size=DEFAULT_CHUNK_SIZE, validated=False, incremental=True):
+    """Import grades from DataFrame using set-based queries and bulk inserts
+
+    df is validated first unless validated is set, i.e. it already is the
+    clean frame returned by validation.validate_frame. Every grade stores a
+    fingerprint of its row, and with incremental set rows whose fingerprint
+    is already stored in the term are skipped before any other work.
+    Returns a dict with imported/inserted/updated/skipped/failed row counts,
+    the rows rejected because their new student could not be created (as
+    validation error records under 'rejected'), throughput and per-stage
+    timings in seconds.
+    """
+    check_term_open(term_id)
+    timer = ImportTimer()
+    start = time.perf_counter()
+    total_rows = len(df)
+
+    with timer.stage('normalize'):
+        frame = df if validated else validate_frame(df)[0]
+
+    with timer.stage('fingerprint'):
+        # The last row wins when a file repeats a student/course pair
+        deduplicated = frame.drop_duplicates(['student_id', 'course_code'], keep='last')
+        repeated = len(frame) - len(deduplicated)
+        frame = deduplicated.assign(letter=get_scale().letter_grades(deduplicated['grade'].to_numpy(dtype=float)))
+        frame['fingerprint'] = row_fingerprints(frame, term_id)
+        skipped = 0
+        if incremental:
+            unchanged = frame['fingerprint'].isin(_existing_fingerprints(frame['fingerprint'], term_id))
+            skipped = int(unchanged.sum())
+            frame = frame[~unchanged]
+
+    if frame.empty:
+        elapsed = time.perf_counter() - start
+        return {
+            'imported': skipped + repeated,
+            'inserted': 0,
+            'updated': 0,
+            'skipped': skipped + repeated,
+            'failed': total_rows - skipped - repeated,
+            'rejected': pd.DataFrame(columns=ERROR_COLUMNS),
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round((skipped + repeated) / elapsed, 1) if elapsed > 0 else 0.0,
+            'timings': {name: round(seconds, 3) for name, seconds in timer.timings.items()}
+        }
+
+    with timer.stage('resolve_students'):
+        student_ids = _fetch_ids(Student, Student.student_id, frame['student_id'].unique().tolist())
+    reasons = _create_students(frame, student_ids, timer, chunk_size)
+
+    with timer.stage('resolve_courses'):
+        course_ids = _fetch_ids(Course, Course.code, frame['course_code'].unique().tolist())
+        _create_courses(frame, course_ids, chunk_size)
+
+    with timer.stage('map_keys'):
+        frame = frame.assign(
+            student_pk=frame['student_id'].map(student_ids),
+            course_pk=frame['course_code'].map(course_ids)
+        )
+        unmapped = frame[frame[['student_pk', 'course_pk']].isna().any(axis=1)]
+        rejected = _rejected_rows(unmapped, reasons)
+        frame = frame.drop(index=unmapped.index)
+        frame = frame.astype({'student_pk': 'int64', 'course_pk': 'int64'})
+        accepted = len(frame) + skipped + repeated
+
+    with timer.stage('match_existing'):
+        frame = frame.merge(_fetch_existing_grades(frame, term_id), on=['student_pk', 'course_pk'], how='left')
+        is_update = frame['grade_pk'].notna()
+
+    with timer.stage('insert_grades'):
+        now = datetime.now()
+        new = frame[~is_update]
+        rows = [{
+            'student_id': int(student_pk),
+            'course_id': int(course_pk),
+            'term_id': term_id,
+            'numeric_grade': float(grade),
+            'letter_grade': letter,
+            'date_added': now,
+            'fingerprint': int(fingerprint)
+        } for student_pk, course_pk, grade, letter, fingerprint in zip(
+            new['student_pk'], new['course_pk'], new['grade'], new['letter'], new['fingerprint'])]
+        _bulk_insert(Grade, rows, chunk_size)
+
+    with timer.stage('update_grades'):
+        changed = frame[is_update]
+        updates = [{
+            'id': int(grade_pk),
+            'numeric_grade': float(grade),
+            'letter_grade': letter,
+            'date_added': now,
+            'fingerprint': int(fingerprint)
+        } for grade_pk, grade, letter, fingerprint in zip(
+            changed['grade_pk'], changed['grade'], changed['letter'], changed['fingerprint'])]
+        for batch in _chunks(updates, chunk_size):
+            db.session.execute(db.update(Grade), batch)
+
+    with timer.stage('update_summaries'):
+        departments = _fetch_map(Student.id, Student.department_id, frame['student_pk'].unique().tolist())
+        credits = _fetch_map(Course.id, Course.credits, frame['course_pk'].unique().tolist())
+        # Replaced grades are taken out of the aggregates before the new values go in
+        apply_grade_deltas(_summary_frame(changed, 'old_grade', 'old_letter', term_id, departments, credits), sign=-1)
+        apply_grade_deltas(_summary_frame(frame, 'grade', 'letter', term_id, departments, credits))
+
+    with timer.stage('update_standings'):
+        refresh_standings(frame['student_pk'].unique())
+
+    with timer.stage('commit'):
+        bump_data_version()
+        db.session.commit()
+    grades_imported.send(current_app._get_current_object(), term_id=term_id, count=len(frame))
+
+    elapsed = time.perf_counter() - start
+    return {
+        'imported': accepted,
+        'inserted': len(rows),
+        'updated': len(updates),
+        'skipped': skipped + repeated,
+        'failed': total_rows - accepted,
+        'rejected': rejected,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(accepted / elapsed, 1) if elapsed > 0 else 0.0,
+        'timings': {name: round(seconds, 3) for name, seconds in timer.timings.items()}
+    }
+
+
+def _fetch_existing_grades(frame, term_id):
+    """Look up grades already stored for the frame's student/course pairs in a term"""
+    course_pks = frame['course_pk'].unique().tolist()
+    rows = []
+    for batch in _chunks(frame['student_pk'].unique().tolist(), IN_CLAUSE_SIZE):
+        query = db.session.query(
+            Grade.id, Grade.student_id, Grade.course_id, Grade.numeric_grade, Grade.letter_grade
+        ).filter(Grade.term_id == term_id, Grade.student_id.in_(batch))
+        if len(course_pks) <= IN_CLAUSE_SIZE:
+            query = query.filter(Grade.course_id.in_(course_pks))
+        rows.extend(query.all())
+    existing = pd.DataFrame(rows, columns=['grade_pk', 'student_pk', 'course_pk', 'old_grade', 'old_letter'])
+    return existing.astype({'student_pk': 'int64', 'course_pk': 'int64'})
+
+
+def _summary_frame(frame, grade_column, letter_column, term_id, departments, credits):
+    """Shape imported rows for apply_grade_deltas"""
+    return pd.DataFrame({
+        'student_pk': frame['student_pk'].to_numpy(),
+        'course_pk': frame['course_pk'].to_numpy(),
+        'department_pk': frame['student_pk'].map(departments).to_numpy(),
+        'term_id': term_id,
+        'grade': frame[grade_column].to_numpy(dtype=float),
+        'letter': frame[letter_column].to_numpy(dtype=object),
+        'credits': frame['course_pk'].map(credits).fillna(0.0).to_numpy(dtype=float)
+    })
+
+
+def count_rows(filepath):
+    """Cheaply estimate the number of data rows in a grade file"""
+    extension = filepath.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        lines = 0
+        with open(filepath, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                lines += block.count(b'\n')
+        return max(lines - 1, 0)
+    if extension == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(filepath, read_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else None
+    return None
+
+
+def file_fingerprint(filepath):
+    """SHA-256 hex digest and size of a file"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest(), os.path.getsize(filepath)
+
+
+def _unchanged_file(term_id, sha256):
+    """The last import into the term if it was this file under the current grading scale"""
+    last = ImportedFile.query.filter_by(term_id=term_id)\
+        .order_by(ImportedFile.imported_at.desc(), ImportedFile.id.desc()).first()
+    if last is not None and last.sha256 == sha256 and last.grading_scale == get_scale().key:
+        return last
+    return None
+
+
+def import_grade_file(filepath, term_id, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+                      workers=1, error_report=None, incremental=True, filename=None):
+    """Stream a grade file into the database, committing once per chunk
+
+    Chunks are parsed and validated by validation.validate_file (across
+    `workers` processes) and rows that fail validation are written to the
+    error_report CSV path, if given. In incremental mode a file identical to
+    the last one imported into the term is skipped as a whole, and rows
+    whose grade is already stored unchanged are skipped (see
+    bulk_import_grades). progress, if given, is called with the running
+    totals after each chunk.
+    """
+    totals = {'imported': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0, 'invalid': 0,
+              'errors': 0, 'chunks': 0, 'unchanged_file': False, 'timings': {}}
+    start = time.perf_counter()
+
+    check_term_open(term_id)
+    sha256, size = file_fingerprint(filepath)
+    previous = _unchanged_file(term_id, sha256) if incremental else None
+    if previous is not None:
+        totals.update(imported=previous.rows_imported, skipped=previous.rows_imported,
+                      failed=previous.rows_failed, unchanged_file=True)
+        totals['seconds'] = round(time.perf_counter() - start, 3)
+        totals['rows_per_sec'] = 0.0
+        if progress:
+            progress(totals)
+        return totals
+
+    report = ErrorReport(error_report)
+    chunks = validate_file(filepath, chunk_size, workers)
+    while True:
+        # Time spent waiting on the parser and validators
+        wait_start = time.perf_counter()
+        chunk = next(chunks, None)
+        totals['timings']['validate'] = round(
+            totals['timings'].get('validate', 0.0) + time.perf_counter() - wait_start, 3)
+        if chunk is None:
+            break
+        frame, errors, rows = chunk
+        report.write(errors)
+        invalid = errors['row'].nunique()
+        totals['invalid'] += invalid
+        totals['errors'] += len(errors)
+        totals['failed'] += invalid
+
+        result = bulk_import_grades(frame, term_id, chunk_size, validated=True, incremental=incremental)
+        if not result['rejected'].empty:
+            logger.warning('Rejected %s rows whose new student could not be created',
+                           result['rejected']['row'].nunique())
+            report.write(result['rejected'])
+            totals['errors'] += len(result['rejected'])
+        for key in ('imported', 'inserted', 'updated', 'skipped', 'failed'):
+            totals[key] += result[key]
+        totals['chunks'] += 1
+        for name, seconds in result['timings'].items():
+            totals['timings'][name] = round(totals['timings'].get(name, 0.0) + seconds, 3)
+
+        elapsed = time.perf_counter() - start
+        totals['seconds'] = round(elapsed, 3)
+        totals['rows_per_sec'] = round(totals['imported'] / elapsed, 1) if elapsed > 0 else 0.0
+        if progress:
+            progress(totals)
+
+    db.session.add(ImportedFile(
+        term_id=term_id,
+        filename=filename or os.path.basename(filepath),
+        sha256=sha256,
+        size=size,
+        grading_scale=get_scale().key,
+        rows_imported=totals['imported'],
+        rows_failed=totals['failed']
+    ))
+    db.session.commit()
+
+    totals.setdefault('seconds', 0.0)
+    totals.setdefault('rows_per_sec', 0.0)
+    return totals
+
+
+def import_grade_data(df, term_id):
+    """Import grades from DataFrame to database"""
+    return bulk_import_grades(df, term_id)['imported']
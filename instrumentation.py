@@ -0,0 +1,233 @@
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter as StatementCounter
+from datetime import datetime
+
+from flask import Response, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from importer import grades_imported
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Prometheus counter with a fixed set of label names"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Histogram:
+    """Prometheus histogram with cumulative buckets per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, ("le", f"{bound:g}"))} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.label_names, labels, ("le", "+Inf"))} {count}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {round(total, 6)}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {count}'
+
+
+class Instrumentation:
+    """Per-request timing, SQL accounting, N+1 detection and sampled profiling
+
+    Every request records its wall time, number of SQL statements and time
+    spent in the database (from SQLAlchemy engine events, so the read-only
+    report engine is included). A statement repeated N_PLUS_ONE_THRESHOLD
+    times in one request is logged as a likely N+1 pattern. Aggregates are
+    served in Prometheus text format on /metrics, to logged-in users or,
+    when METRICS_TOKEN is set, only to clients sending it as a bearer token.
+    With PROFILE_SAMPLE_RATE above 0, that share of requests runs under
+    cProfile and the profile is written to PROFILE_DIR when the request
+    takes longer than SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request wall time', ('method', 'endpoint', 'status'))
+        self.request_queries = Histogram(
+            'http_request_sql_queries', 'SQL statements per request', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_db_time = Histogram(
+            'http_request_db_seconds', 'Database time per request', ('endpoint',))
+        self.query_duration = Histogram(
+            'sql_query_duration_seconds', 'Duration of individual SQL statements', ('context',))
+        self.n_plus_one = Counter(
+            'sql_n_plus_one_total', 'Requests that repeated one statement past the N+1 threshold', ('endpoint',))
+        self.slow_requests = Counter(
+            'http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS', ('endpoint',))
+        self.profiles = Counter('http_profiles_written_total', 'cProfile dumps written', ('endpoint',))
+        self.imported_rows = Counter('grade_import_rows_total', 'Grade rows committed by imports')
+        self.metrics = [self.request_duration, self.request_queries, self.request_db_time, self.query_duration,
+                        self.n_plus_one, self.slow_requests, self.profiles, self.imported_rows]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_REQUEST_MS', 1000)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('METRICS_TOKEN', None)
+        self.app = app
+
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        grades_imported.connect(self._on_grades_imported, weak=False)
+        app.extensions['instrumentation'] = self
+
+    def _on_grades_imported(self, sender, count=0, **extra):
+        self.imported_rows.inc(amount=count)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        in_request = has_request_context() and 'sql_statements' in g
+        self.query_duration.observe(elapsed, 'request' if in_request else 'background')
+        if in_request:
+            g.sql_time += elapsed
+            g.sql_statements[statement] += 1
+
+    def _before_request(self):
+        g.request_start = time.perf_counter()
+        g.sql_time = 0.0
+        g.sql_statements = StatementCounter()
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after_request(self, response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics':
+            return response
+        queries = sum(g.sql_statements.values())
+        self.request_duration.observe(elapsed, request.method, endpoint, str(response.status_code))
+        self.request_queries.observe(queries, endpoint)
+        self.request_db_time.observe(g.sql_time, endpoint)
+        response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;dur={g.sql_time * 1000:.1f}'
+
+        threshold = self.app.config['N_PLUS_ONE_THRESHOLD']
+        repeated = [(statement, count) for statement, count in g.sql_statements.items() if count >= threshold]
+        if repeated:
+            statement, count = max(repeated, key=lambda item: item[1])
+            self.n_plus_one.inc(endpoint)
+            self.app.logger.warning('Possible N+1 in %s: statement ran %s times: %s',
+                                    endpoint, count, ' '.join(statement.split())[:300])
+
+        if elapsed * 1000 >= self.app.config['SLOW_REQUEST_MS']:
+            self.slow_requests.inc(endpoint)
+            self.app.logger.warning('Slow request %s %s took %.0fms with %s queries (%.0fms in the database)',
+                                    request.method, request.path, elapsed * 1000, queries, g.sql_time * 1000)
+            if profiler is not None:
+                self._dump_profile(profiler, endpoint)
+        return response
+
+    def _dump_profile(self, profiler, endpoint):
+        directory = self.app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint)
+        path = os.path.join(directory, f'{datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")}_{name}.prof')
+        profiler.dump_stats(path)
+        self.profiles.inc(endpoint)
+        self.app.logger.info('Wrote profile %s', path)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        token = self.app.config['METRICS_TOKEN']
+        if token:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                return Response('Unauthorized', status=401, headers={'WWW-Authenticate': 'Bearer'})
+        elif not current_user.is_authenticated:
+            return self.app.login_manager.unauthorized()
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
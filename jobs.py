@@ -0,0 +1,143 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, ImportJob
+from importer import count_rows, import_grade_file
+
+
+class JobQueue:
+    """Run grade imports on a local thread pool, tracked in the import_job table
+
+    Each job records the process that owns it, and that process refreshes
+    updated_at on its unfinished jobs every IMPORT_JOB_HEARTBEAT_SECONDS,
+    including jobs still waiting in its pool. A job is only given up on once
+    its owner has stopped doing so for IMPORT_JOB_STALE_SECONDS.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self._heartbeat = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMPORT_WORKERS', 2)
+        app.config.setdefault('IMPORT_JOB_STALE_SECONDS', 600)
+        app.config.setdefault('IMPORT_JOB_HEARTBEAT_SECONDS', 30)
+        app.config.setdefault('VALIDATION_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('IMPORT_INCREMENTAL', True)
+        app.config.setdefault('IMPORT_ERRORS_DIR', os.path.join(app.instance_path, 'import_errors'))
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config['IMPORT_WORKERS'],
+            thread_name_prefix='import-job'
+        )
+        app.extensions['job_queue'] = self
+
+    def enqueue(self, filepath, filename, term_id, user_id=None):
+        """Record a queued import job and hand it to the worker pool"""
+        job = ImportJob(
+            filename=filename,
+            filepath=filepath,
+            term_id=term_id,
+            user_id=user_id,
+            status='queued',
+            worker=self.worker
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._start_heartbeat()
+        self.executor.submit(self._run, job.id)
+        return job
+
+    @property
+    def worker(self):
+        """host:pid of this process, read per call since workers fork after import"""
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, name='import-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        interval = self.app.config['IMPORT_JOB_HEARTBEAT_SECONDS']
+        while True:
+            time.sleep(interval)
+            try:
+                with self.app.app_context():
+                    ImportJob.query\
+                        .filter(ImportJob.worker == self.worker)\
+                        .filter(ImportJob.status.in_(['queued', 'running']))\
+                        .update({ImportJob.updated_at: datetime.utcnow()}, synchronize_session=False)
+                    db.session.commit()
+            except Exception:
+                self.app.logger.exception('Could not refresh the import job heartbeat')
+
+    def error_report_path(self, job_id):
+        """CSV of the rows that failed validation in a job, written only when there are any"""
+        return os.path.join(self.app.config['IMPORT_ERRORS_DIR'], f'import_job_{job_id}_errors.csv')
+
+    def recover_stale_jobs(self):
+        """Fail jobs whose owning process stopped its heartbeat, e.g. after a restart"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['IMPORT_JOB_STALE_SECONDS'])
+        stale = ImportJob.query\
+            .filter(ImportJob.status.in_(['queued', 'running']))\
+            .filter(ImportJob.updated_at < cutoff)\
+            .filter(db.or_(ImportJob.worker.is_(None), ImportJob.worker != self.worker))\
+            .all()
+        for job in stale:
+            job.status = 'failed'
+            job.error = 'Worker stopped before the job finished'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return len(stale)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(ImportJob, job_id)
+            if job is None or job.status != 'queued':
+                # Already given up on by recover_stale_jobs
+                return
+            job.status = 'running'
+            job.started_at = job.updated_at = datetime.utcnow()
+            db.session.commit()
+
+            def progress(totals):
+                job.rows_processed = totals['imported'] + totals['failed']
+                job.rows_failed = totals['failed']
+                job.rows_inserted = totals['inserted']
+                job.rows_updated = totals['updated']
+                job.rows_skipped = totals['skipped']
+                job.updated_at = datetime.utcnow()
+                db.session.commit()
+
+            try:
+                # Inside the try so an unreadable upload fails the job and is removed
+                job.total_rows = count_rows(job.filepath)
+                db.session.commit()
+                result = import_grade_file(
+                    job.filepath, job.term_id, self.app.config['IMPORT_CHUNK_SIZE'], progress,
+                    workers=self.app.config['VALIDATION_WORKERS'], error_report=self.error_report_path(job_id),
+                    incremental=self.app.config['IMPORT_INCREMENTAL'], filename=job.filename
+                )
+                job.status = 'completed'
+                self.app.logger.info('Import job %s finished in %ss: %s', job_id,
+                                     result['seconds'], result['timings'])
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.error = str(e)
+                self.app.logger.exception('Import job %s failed', job_id)
+            finally:
+                job.finished_at = job.updated_at = datetime.utcnow()
+                db.session.commit()
+                if os.path.exists(job.filepath):
+                    os.remove(job.filepath)
@@ -0,0 +1,120 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+
+from models import db, Grade
+from summaries import rebuild_summaries
+
+# Report plans may read these tables only through an index
+INDEXED_TABLES = ('grade',)
+
+
+def _newest_grades():
+    return db.session.query(db.func.max(Grade.id))\
+        .group_by(Grade.student_id, Grade.course_id, Grade.term_id)
+
+
+def count_duplicate_grades():
+    """Grades that share a (student, course, term) with a newer grade"""
+    return Grade.query.filter(Grade.id.not_in(_newest_grades())).count()
+
+
+def _remove_duplicate_grades():
+    """Keep the newest grade for each (student, course, term) before enforcing uniqueness"""
+    newest = _newest_grades()
+    removed = Grade.query.filter(Grade.id.not_in(newest)).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def _add_missing_columns(engine, inspector, table):
+    """ALTER TABLE ADD COLUMN for nullable model columns the table lacks"""
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} to an existing table')
+        column_type = column.type.compile(dialect=engine.dialect)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        except OperationalError as e:
+            # SQLite has no ADD COLUMN IF NOT EXISTS; another process may have just added it
+            if 'duplicate column' not in str(e).lower():
+                raise
+            continue
+        added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def pending_upgrades():
+    """Names of the model columns and indexes missing from existing tables
+
+    Read-only, so it is safe to call from every worker at startup; the
+    changes themselves are made by upgrade_schema through `flask upgrade-db`.
+    """
+    inspector = inspect(db.engine)
+    pending = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        pending.extend(f'{table.name}.{column.name}' for column in table.columns if column.name not in existing)
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        pending.extend(index.name for index in table.indexes if index.name not in existing)
+    return pending
+
+
+def upgrade_schema():
+    """Bring an existing database up to the current models
+
+    db.create_all() only creates missing tables, so nullable columns and
+    indexes declared on tables that already exist are added here. Duplicate
+    grades are collapsed before the unique (student, course, term) index is
+    built, which deletes rows, so this only runs from `flask upgrade-db`.
+    Returns the names of the columns and indexes that were created and the
+    number of duplicate grades removed.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    created = []
+    duplicates_removed = 0
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        created.extend(_add_missing_columns(engine, inspector, table))
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            if table.name == 'grade' and index.unique:
+                duplicates_removed += _remove_duplicate_grades()
+            with engine.begin() as connection:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            created.append(index.name)
+
+    if duplicates_removed:
+        rebuild_summaries()
+    return created, duplicates_removed
+
+
+def explain(query):
+    """Return SQLite's EXPLAIN QUERY PLAN detail lines for an ORM query"""
+    sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans(queries):
+    """Return {name: plan} for every query whose plan scans a hot table without an index"""
+    failures = {}
+    for name, query in queries.items():
+        plan = explain(query)
+        for detail in plan:
+            words = detail.split()
+            if words[:1] == ['SCAN'] and words[1] in INDEXED_TABLES and 'INDEX' not in words:
+                failures[name] = plan
+                break
+    return failures
@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from grading import GRADE_POINTS
 
 db = SQLAlchemy()
 
@@ -29,10 +30,18 @@ class Term(db.Model):
     start_date = db.Column(db.Date, nullable=True)
     end_date = db.Column(db.Date, nullable=True)
     is_active = db.Column(db.Boolean, default=False)
+    # Set once the term's grades were moved to a snapshot (see archive.py)
+    archived_at = db.Column(db.DateTime, nullable=True)
     
     grades = db.relationship('Grade', backref='term', lazy=True)
 
 class Student(db.Model):
+    __table_args__ = (
+        # Keyset pagination order for the student listing, overall and per department
+        db.Index('ix_student_name', 'last_name', 'first_name', 'id'),
+        db.Index('ix_student_department_name', 'department_id', 'last_name', 'first_name', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.String(20), unique=True, nullable=False)
     first_name = db.Column(db.String(50), nullable=False)
@@ -50,40 +59,41 @@ class Student(db.Model):
     @property
     def gpa(self):
         """Calculate student's GPA"""
-        grades = Grade.query.filter_by(student_id=self.id).all()
-        if not grades:
-            return 0.0
-            
-        total_points = 0.0
-        total_credits = 0.0
-        
-        for grade in grades:
-            course_credits = grade.course.credits
-            total_credits += course_credits
-            total_points += grade.grade_points * course_credits
-            
-        return round(total_points / total_credits, 2) if total_credits > 0 else 0.0
+        return calculate_gpas([self.id]).get(self.id, 0.0)
 
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(20), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     credits = db.Column(db.Float, default=3.0)
-    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True, index=True)
     
     grades = db.relationship('Grade', backref='course', lazy=True)
     
     @property
     def average_grade(self):
         """Calculate course average grade"""
-        grades = Grade.query.filter_by(course_id=self.id).all()
-        if not grades:
+        count, total = db.session.query(
+            db.func.sum(GradeSummary.count),
+            db.func.sum(GradeSummary.total)
+        ).filter(GradeSummary.scope == 'course', GradeSummary.key_id == self.id).one()
+        if not count:
             return 0.0
             
-        total = sum(grade.numeric_grade for grade in grades)
-        return round(total / len(grades), 2)
+        return round(total / count, 2)
 
 class Grade(db.Model):
+    __table_args__ = (
+        # One grade per student, course and term; re-imports update it in place
+        db.Index('uq_grade_student_course_term', 'student_id', 'course_id', 'term_id', unique=True),
+        db.Index('ix_grade_course_term_letter', 'course_id', 'term_id', 'letter_grade'),
+        db.Index('ix_grade_term_letter', 'term_id', 'letter_grade'),
+        db.Index('ix_grade_term_student_grade', 'term_id', 'student_id', 'numeric_grade'),
+        db.Index('ix_grade_letter', 'letter_grade'),
+        db.Index('ix_grade_date_added', 'date_added'),
+        db.Index('ix_grade_term_fingerprint', 'term_id', 'fingerprint'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
@@ -91,15 +101,205 @@ class Grade(db.Model):
     numeric_grade = db.Column(db.Float, nullable=False)
     letter_grade = db.Column(db.String(2), nullable=False)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    # Hash of the imported row (student, course, term, grade, letter) used to skip unchanged re-imports
+    fingerprint = db.Column(db.BigInteger, nullable=True)
     
     @property
     def grade_points(self):
         """Convert letter grade to grade points for GPA calculation"""
-        grade_map = {
-            'A+': 4.0, 'A': 4.0, 'A-': 3.7,
-            'B+': 3.3, 'B': 3.0, 'B-': 2.7,
-            'C+': 2.3, 'C': 2.0, 'C-': 1.7,
-            'D+': 1.3, 'D': 1.0, 'D-': 0.7,
-            'F': 0.0
+        return GRADE_POINTS.get(self.letter_grade, 0.0)
+
+class GradeSummary(db.Model):
+    """Running grade aggregates per scope key and term, maintained on import"""
+    __table_args__ = (
+        db.Index('uq_grade_summary_key', 'scope', 'key_id', 'term_id', unique=True),
+        db.Index('ix_grade_summary_scope_term', 'scope', 'term_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # student, course, department or term
+    key_id = db.Column(db.Integer, nullable=False)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Float, default=0.0, nullable=False)
+    total_squares = db.Column(db.Float, default=0.0, nullable=False)
+    credits = db.Column(db.Float, default=0.0, nullable=False)
+    weighted_points = db.Column(db.Float, default=0.0, nullable=False)
+
+class GradeLetterSummary(db.Model):
+    """Letter grade counts per scope key and term, maintained on import"""
+    __table_args__ = (
+        db.Index('uq_grade_letter_summary_key', 'scope', 'key_id', 'term_id', 'letter_grade', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)
+    key_id = db.Column(db.Integer, nullable=False)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False)
+    letter_grade = db.Column(db.String(2), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+class StudentStanding(db.Model):
+    """Grade average, GPA and latest term-over-term change per student, maintained on import"""
+    __table_args__ = (
+        db.Index('ix_student_standing_average', 'average_grade'),
+        db.Index('ix_student_standing_department_average', 'department_id', 'average_grade'),
+        db.Index('ix_student_standing_decline', 'decline'),
+    )
+    
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    grade_count = db.Column(db.Integer, default=0, nullable=False)
+    average_grade = db.Column(db.Float, nullable=False)
+    gpa = db.Column(db.Float, default=0.0, nullable=False)
+    last_term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=True)
+    last_term_average = db.Column(db.Float, nullable=True)
+    previous_term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=True)
+    previous_term_average = db.Column(db.Float, nullable=True)
+    # Previous minus last term average, so a positive value is a decline
+    decline = db.Column(db.Float, nullable=True)
+
+class StudentTermStanding(db.Model):
+    """Grade average and GPA per student and term, maintained on import"""
+    __table_args__ = (
+        db.Index('uq_student_term_standing', 'student_id', 'term_id', unique=True),
+        db.Index('ix_student_term_standing_term_average', 'term_id', 'average_grade'),
+        db.Index('ix_student_term_standing_department_term_average', 'department_id', 'term_id', 'average_grade'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    grade_count = db.Column(db.Integer, default=0, nullable=False)
+    average_grade = db.Column(db.Float, nullable=False)
+    gpa = db.Column(db.Float, default=0.0, nullable=False)
+
+class DataVersion(db.Model):
+    """Single-row counter bumped whenever imported grades change"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def bump_data_version():
+    """Increment the data version inside the current transaction"""
+    updated = DataVersion.query.filter_by(id=1).update({
+        DataVersion.version: DataVersion.version + 1,
+        DataVersion.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(DataVersion(id=1, version=1))
+
+def get_data_version():
+    """Return the current data version, 0 before the first import"""
+    return get_data_version_info()[0]
+
+def get_data_version_info():
+    """Return (version, time of the last change), (0, None) before the first import"""
+    row = db.session.query(DataVersion.version, DataVersion.updated_at).filter_by(id=1).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+def grade_points_expr():
+    """SQL expression converting Grade.letter_grade to grade points"""
+    return db.case(GRADE_POINTS, value=Grade.letter_grade, else_=0.0)
+
+def calculate_gpas(student_ids=None, department_id=None):
+    """Return a {student id: GPA} dict computed with one aggregate over the student summaries
+
+    The summaries cover archived terms, whose grades are no longer in the
+    grade table. Pass student_ids to limit the result to those students, or
+    department_id to rank a whole department. Students without grades get a
+    GPA of 0.0.
+    """
+    query = db.session.query(
+        GradeSummary.key_id,
+        db.func.sum(GradeSummary.weighted_points),
+        db.func.sum(GradeSummary.credits)
+    ).filter(GradeSummary.scope == 'student')
+    
+    if department_id:
+        query = query.join(Student, Student.id == GradeSummary.key_id)\
+                     .filter(Student.department_id == department_id)
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        if not student_ids:
+            return {}
+        query = query.filter(GradeSummary.key_id.in_(student_ids))
+    
+    gpas = {student_id: 0.0 for student_id in student_ids or []}
+    for student_id, points, credits in query.group_by(GradeSummary.key_id).all():
+        gpas[student_id] = round(points / credits, 2) if credits else 0.0
+    return gpas
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    filepath = db.Column(db.String(500), nullable=False)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    # host:pid of the process whose worker pool holds the job
+    worker = db.Column(db.String(255), nullable=True)
+    total_rows = db.Column(db.Integer, nullable=True)
+    rows_processed = db.Column(db.Integer, default=0)
+    rows_failed = db.Column(db.Integer, default=0)
+    rows_inserted = db.Column(db.Integer, default=0)
+    rows_updated = db.Column(db.Integer, default=0)
+    rows_skipped = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, nullable=True)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def throughput(self):
+        """Rows processed per second since the job started"""
+        if not self.started_at:
+            return 0.0
+        elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self):
+        """Estimated seconds until the job finishes"""
+        if self.status != 'running' or not self.total_rows or not self.throughput:
+            return None
+        remaining = max(self.total_rows - self.rows_processed, 0)
+        return round(remaining / self.throughput, 1)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'term_id': self.term_id,
+            'status': self.status,
+            'total_rows': self.total_rows,
+            'rows_processed': self.rows_processed,
+            'rows_failed': self.rows_failed,
+            'rows_inserted': self.rows_inserted,
+            'rows_updated': self.rows_updated,
+            'rows_skipped': self.rows_skipped,
+            'throughput': self.throughput,
+            'eta_seconds': self.eta_seconds,
+            'error': self.error,
+            'created_at': self.date_created.isoformat() if self.date_created else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
-        return grade_map.get(self.letter_grade, 0.0)
\ No newline at end of file
+
+class ImportedFile(db.Model):
+    """Fingerprint of a grade file imported into a term, used to skip identical re-uploads"""
+    __table_args__ = (
+        db.Index('ix_imported_file_term', 'term_id', 'imported_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    grading_scale = db.Column(db.String(255), nullable=False)
+    rows_imported = db.Column(db.Integer, default=0, nullable=False)
+    rows_failed = db.Column(db.Integer, default=0, nullable=False)
+    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+
+from database import read_session
+from models import db, Student, Department, Term, GradeSummary, StudentStanding, StudentTermStanding
+from grading import get_at_risk_threshold, get_decline_threshold
+
+# Keep IN (...) lists below SQLite's bound-parameter limit
+IN_CLAUSE_SIZE = 500
+
+# Fields of the student lists, named like the student report columns
+STANDING_COLUMNS = ['id', 'student_id', 'first_name', 'last_name', 'department',
+                    'grade_count', 'average_grade', 'gpa']
+
+
+def _term_order():
+    """Position of every term, ordered by start date (undated terms last) and id"""
+    terms = pd.DataFrame(db.session.query(Term.id, Term.start_date).all(), columns=['term_id', 'start_date'])
+    terms['undated'] = terms['start_date'].isna()
+    terms = terms.sort_values(['undated', 'start_date', 'term_id'])
+    return pd.Series(np.arange(len(terms)), index=terms['term_id'].to_numpy())
+
+
+def _records(frame):
+    """Plain dict rows with missing values as None"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def _standing_rows(summaries, departments, term_order):
+    """Term and overall standing rows from student summary rows
+
+    summaries has student_pk, term_id, count, total, credits and
+    weighted_points columns, one row per student and term.
+    """
+    summaries = summaries[summaries['count'] > 0]
+    department_ids = summaries['student_pk'].map(departments).astype('Int64')
+    term_rows = pd.DataFrame({
+        'student_id': summaries['student_pk'].astype('int64'),
+        'term_id': summaries['term_id'].astype('int64'),
+        'department_id': department_ids,
+        'grade_count': summaries['count'].astype('int64'),
+        'average_grade': summaries['total'] / summaries['count'],
+        'gpa': _gpa(summaries['weighted_points'], summaries['credits'])
+    })
+
+    totals = summaries.groupby('student_pk')[['count', 'total', 'credits', 'weighted_points']].sum()
+    ordered = term_rows.assign(position=term_rows['term_id'].map(term_order))\
+        .sort_values(['student_id', 'position'])
+    last = ordered.groupby('student_id').nth(-1).set_index('student_id').reindex(totals.index)
+    previous = ordered.groupby('student_id').nth(-2).set_index('student_id').reindex(totals.index)
+    standing_rows = pd.DataFrame({
+        'student_id': totals.index.astype('int64'),
+        'department_id': totals.index.map(departments).astype('Int64'),
+        'grade_count': totals['count'].astype('int64').to_numpy(),
+        'average_grade': (totals['total'] / totals['count']).to_numpy(),
+        'gpa': _gpa(totals['weighted_points'], totals['credits']).to_numpy(),
+        'last_term_id': last['term_id'].astype('Int64').to_numpy(),
+        'last_term_average': last['average_grade'].to_numpy(),
+        'previous_term_id': previous['term_id'].astype('Int64').to_numpy(),
+        'previous_term_average': previous['average_grade'].to_numpy(),
+        'decline': (previous['average_grade'] - last['average_grade']).to_numpy()
+    })
+    return _records(term_rows), _records(standing_rows)
+
+
+def _gpa(weighted_points, credits):
+    """Credit-weighted grade points, 0 without credits"""
+    return (weighted_points / credits.where(credits > 0)).fillna(0.0).round(2)
+
+
+def _student_summaries(student_pks=None):
+    query = db.session.query(
+        GradeSummary.key_id, GradeSummary.term_id, GradeSummary.count,
+        GradeSummary.total, GradeSummary.credits, GradeSummary.weighted_points
+    ).filter(GradeSummary.scope == 'student')
+    columns = ['student_pk', 'term_id', 'count', 'total', 'credits', 'weighted_points']
+    if student_pks is None:
+        return pd.DataFrame(query.all(), columns=columns)
+    rows = []
+    for start in range(0, len(student_pks), IN_CLAUSE_SIZE):
+        rows.extend(query.filter(GradeSummary.key_id.in_(student_pks[start:start + IN_CLAUSE_SIZE])).all())
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _departments(student_pks=None):
+    query = db.session.query(Student.id, Student.department_id)
+    if student_pks is None:
+        return dict(query.all())
+    found = {}
+    for start in range(0, len(student_pks), IN_CLAUSE_SIZE):
+        found.update(query.filter(Student.id.in_(student_pks[start:start + IN_CLAUSE_SIZE])).all())
+    return found
+
+
+def refresh_standings(student_pks):
+    """Recompute the standings of some students from their summary rows
+
+    Runs inside the caller's transaction, after the summaries were updated.
+    """
+    student_pks = [int(pk) for pk in pd.unique(np.asarray(student_pks))]
+    if not student_pks:
+        return
+    for start in range(0, len(student_pks), IN_CLAUSE_SIZE):
+        batch = student_pks[start:start + IN_CLAUSE_SIZE]
+        StudentTermStanding.query.filter(StudentTermStanding.student_id.in_(batch)).delete(synchronize_session=False)
+        StudentStanding.query.filter(StudentStanding.student_id.in_(batch)).delete(synchronize_session=False)
+    _insert_standings(_student_summaries(student_pks), _departments(student_pks))
+
+
+def rebuild_standings():
+    """Recompute every standing row from the student summary rows"""
+    StudentTermStanding.query.delete()
+    StudentStanding.query.delete()
+    _insert_standings(_student_summaries(), _departments())
+
+
+def _insert_standings(summaries, departments):
+    if summaries.empty:
+        return
+    term_rows, standing_rows = _standing_rows(summaries, departments, _term_order())
+    if term_rows:
+        db.session.execute(db.insert(StudentTermStanding), term_rows)
+    if standing_rows:
+        db.session.execute(db.insert(StudentStanding), standing_rows)
+
+
+def standings_missing():
+    """True when summaries exist but the standing tables have never been built"""
+    return db.session.query(StudentStanding.student_id).first() is None\
+        and db.session.query(GradeSummary.id).filter(GradeSummary.scope == 'student').first() is not None
+
+
+def _standing_model(term_id):
+    """Overall standings, or the term standings when term_id is given"""
+    return StudentTermStanding if term_id else StudentStanding
+
+
+def _filtered(query, model, department_id=None, term_id=None):
+    if term_id:
+        query = query.filter(StudentTermStanding.term_id == term_id)
+    if department_id:
+        query = query.filter(model.department_id == department_id)
+    return query
+
+
+def at_risk_count(threshold=None, department_id=None, term_id=None):
+    """Number of students averaging below threshold, counted on the average index"""
+    if threshold is None:
+        threshold = get_at_risk_threshold()
+    model = _standing_model(term_id)
+    query = read_session().query(db.func.count()).select_from(model)\
+        .filter(model.average_grade < threshold)
+    return _filtered(query, model, department_id, term_id).scalar()
+
+
+def _students_query(model, extra_columns=()):
+    return read_session().query(
+        model.student_id, Student.student_id, Student.first_name, Student.last_name, Department.name,
+        model.grade_count, model.average_grade, model.gpa, *extra_columns
+    ).join(Student, Student.id == model.student_id)\
+     .outerjoin(Department, Department.id == model.department_id)
+
+
+def at_risk_students(threshold=None, department_id=None, term_id=None, limit=None):
+    """Students averaging below threshold, lowest average first
+
+    Averages cover all terms, or only term_id when given.
+    """
+    if threshold is None:
+        threshold = get_at_risk_threshold()
+    model = _standing_model(term_id)
+    query = _filtered(_students_query(model), model, department_id, term_id)\
+        .filter(model.average_grade < threshold)\
+        .order_by(model.average_grade, model.student_id)
+    if limit:
+        query = query.limit(limit)
+    return [dict(zip(STANDING_COLUMNS, row)) for row in query.all()]
+
+
+def declining_students(min_drop=None, department_id=None, limit=None):
+    """Students whose last term average fell at least min_drop below the previous term's"""
+    if min_drop is None:
+        min_drop = get_decline_threshold()
+    query = _students_query(StudentStanding, (
+        StudentStanding.previous_term_id, StudentStanding.previous_term_average,
+        StudentStanding.last_term_id, StudentStanding.last_term_average, StudentStanding.decline
+    ))
+    query = _filtered(query, StudentStanding, department_id)\
+        .filter(StudentStanding.decline >= min_drop)\
+        .order_by(StudentStanding.decline.desc(), StudentStanding.student_id)
+    if limit:
+        query = query.limit(limit)
+    columns = STANDING_COLUMNS + ['previous_term_id', 'previous_term_average', 'last_term_id',
+                                  'last_term_average', 'decline']
+    return [dict(zip(columns, row)) for row in query.all()]
+
+
+def at_risk_report(department_id=None, term_id=None, threshold=None):
+    """Rows of the at_risk_students report, read from the standing tables"""
+    if threshold is None:
+        threshold = get_at_risk_threshold()
+    model = _standing_model(term_id)
+    query = read_session().query(
+        Student.id, Student.student_id, Student.first_name, Student.last_name,
+        Department.name.label('department'), model.average_grade
+    ).join(Student, Student.id == model.student_id)\
+     .join(Department, Department.id == Student.department_id)\
+     .filter(model.average_grade < threshold)
+    return _filtered(query, model, department_id, term_id).order_by(Student.id).all()
@@ -0,0 +1,370 @@
+import pandas as pd
+
+from database import read_session
+from models import db, Student, Course, Grade, Department, Term, GradeSummary, GradeLetterSummary, grade_points_expr
+from grading import letter_grade_points
+from archive import archive
+from standings import at_risk_count, at_risk_report, rebuild_standings
+
+# Frame column holding the key of each summary scope
+SCOPE_KEYS = {
+    'student': 'student_pk',
+    'course': 'course_pk',
+    'department': 'department_pk',
+    'term': 'term_pk'
+}
+
+SUMMARY_VALUES = ['count', 'total', 'total_squares', 'credits', 'weighted_points']
+
+
+def _dialect_insert():
+    """Return the insert construct that supports ON CONFLICT for the bound database"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def _upsert_increments(model, key_columns, value_columns, rows):
+    """Add each row's values onto the matching summary row, creating it if needed"""
+    if not rows:
+        return
+    insert = _dialect_insert()
+    if insert is None:
+        # Fallback for databases without ON CONFLICT support
+        for row in rows:
+            query = model.query.filter_by(**{column: row[column] for column in key_columns})
+            updated = query.update({
+                getattr(model, column): getattr(model, column) + row[column] for column in value_columns
+            }, synchronize_session=False)
+            if not updated:
+                db.session.execute(db.insert(model), [row])
+        return
+
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column: getattr(model.__table__.c, column) + stmt.excluded[column] for column in value_columns}
+    )
+    db.session.execute(stmt, rows)
+
+
+def apply_grade_deltas(frame, sign=1):
+    """Fold a batch of grades into the summary tables
+
+    frame needs student_pk, course_pk, department_pk, term_id, grade,
+    letter and credits columns. Use sign=-1 to remove grades again.
+    """
+    if frame.empty:
+        return
+    frame = frame.assign(
+        term_pk=frame['term_id'],
+        count=sign,
+        total=sign * frame['grade'],
+        total_squares=sign * frame['grade'] ** 2,
+        credits=sign * frame['credits'],
+        weighted_points=sign * letter_grade_points(frame['letter']) * frame['credits']
+    )
+
+    for scope, key in SCOPE_KEYS.items():
+        groups = frame.groupby([key, 'term_id'], sort=False)
+        totals = groups[SUMMARY_VALUES].sum().reset_index()
+        _upsert_increments(GradeSummary, ['scope', 'key_id', 'term_id'], SUMMARY_VALUES, [{
+            'scope': scope,
+            'key_id': int(row[0]),
+            'term_id': int(row[1]),
+            'count': int(row[2]),
+            'total': float(row[3]),
+            'total_squares': float(row[4]),
+            'credits': float(row[5]),
+            'weighted_points': float(row[6])
+        } for row in totals.itertuples(index=False)])
+
+        letters = frame.groupby([key, 'term_id', 'letter'], sort=False)['count'].sum().reset_index()
+        _upsert_increments(GradeLetterSummary, ['scope', 'key_id', 'term_id', 'letter_grade'], ['count'], [{
+            'scope': scope,
+            'key_id': int(row[0]),
+            'term_id': int(row[1]),
+            'letter_grade': row[2],
+            'count': int(row[3])
+        } for row in letters.itertuples(index=False)])
+
+
+def _insert_rows(model, rows):
+    """Insert plain dict rows, skipping empty batches"""
+    if rows:
+        db.session.execute(db.insert(model), rows)
+
+
+def rebuild_summaries():
+    """Recompute every summary row from the grade table and the archived term snapshots"""
+    GradeLetterSummary.query.delete()
+    GradeSummary.query.delete()
+
+    scope_columns = {
+        'student': Grade.student_id,
+        'course': Grade.course_id,
+        'department': Student.department_id,
+        'term': Grade.term_id
+    }
+    for scope, key_column in scope_columns.items():
+        rows = db.session.query(
+            key_column,
+            Grade.term_id,
+            db.func.count(Grade.id),
+            db.func.sum(Grade.numeric_grade),
+            db.func.sum(Grade.numeric_grade * Grade.numeric_grade),
+            db.func.sum(Course.credits),
+            db.func.sum(grade_points_expr() * Course.credits)
+        ).join(Student, Student.id == Grade.student_id)\
+         .join(Course, Course.id == Grade.course_id)\
+         .group_by(key_column, Grade.term_id).all()
+        _insert_rows(GradeSummary, [{
+            'scope': scope,
+            'key_id': key_id,
+            'term_id': term_id,
+            'count': count,
+            'total': total,
+            'total_squares': squares,
+            'credits': credits or 0.0,
+            'weighted_points': points or 0.0
+        } for key_id, term_id, count, total, squares, credits, points in rows])
+
+        letters = db.session.query(
+            key_column,
+            Grade.term_id,
+            Grade.letter_grade,
+            db.func.count(Grade.id)
+        ).join(Student, Student.id == Grade.student_id)\
+         .group_by(key_column, Grade.term_id, Grade.letter_grade).all()
+        _insert_rows(GradeLetterSummary, [{
+            'scope': scope,
+            'key_id': key_id,
+            'term_id': term_id,
+            'letter_grade': letter,
+            'count': count
+        } for key_id, term_id, letter, count in letters])
+
+    # Archived terms have no grade rows left; their aggregates were frozen with the snapshot
+    archived, archived_letters = archive.summary_rows()
+    _insert_rows(GradeSummary, archived)
+    _insert_rows(GradeLetterSummary, archived_letters)
+
+    rebuild_standings()
+    db.session.commit()
+
+
+def summaries_missing():
+    """True when grades exist but the summary tables have never been built"""
+    return db.session.query(GradeSummary.id).first() is None\
+        and db.session.query(Grade.id).first() is not None
+
+
+def _average():
+    """Mean grade over the summary rows in a group"""
+    return db.func.sum(GradeSummary.total) / db.func.sum(GradeSummary.count)
+
+
+def letter_distribution(scope='term', key_id=None, term_id=None):
+    """Letter grade counts for one scope key (or all keys) and optional term"""
+    session = read_session()
+    query = session.query(
+        GradeLetterSummary.letter_grade,
+        db.func.sum(GradeLetterSummary.count)
+    ).filter(GradeLetterSummary.scope == scope)
+
+    if key_id:
+        query = query.filter(GradeLetterSummary.key_id == key_id)
+    if term_id:
+        query = query.filter(GradeLetterSummary.term_id == term_id)
+
+    return query.group_by(GradeLetterSummary.letter_grade)\
+        .having(db.func.sum(GradeLetterSummary.count) > 0).all()
+
+
+def course_letter_distributions(course_ids, term_id=None):
+    """Letter grade counts for several courses as {course id: [(letter, count)]}"""
+    query = read_session().query(
+        GradeLetterSummary.key_id,
+        GradeLetterSummary.letter_grade,
+        db.func.sum(GradeLetterSummary.count)
+    ).filter(GradeLetterSummary.scope == 'course', GradeLetterSummary.key_id.in_(course_ids))
+
+    if term_id:
+        query = query.filter(GradeLetterSummary.term_id == term_id)
+
+    distributions = {course_id: [] for course_id in course_ids}
+    rows = query.group_by(GradeLetterSummary.key_id, GradeLetterSummary.letter_grade)\
+        .having(db.func.sum(GradeLetterSummary.count) > 0)\
+        .order_by(GradeLetterSummary.key_id, GradeLetterSummary.letter_grade).all()
+    for course_id, letter, count in rows:
+        distributions[course_id].append((letter, count))
+    return distributions
+
+
+def summary_statistics(at_risk_threshold=None):
+    """Dashboard statistics read from the summary and standing tables"""
+    session = read_session()
+    count, total = session.query(
+        db.func.sum(GradeSummary.count),
+        db.func.sum(GradeSummary.total)
+    ).filter(GradeSummary.scope == 'term').one()
+
+    dept_avg = session.query(
+        Department.name,
+        _average().label('avg_grade')
+    ).join(GradeSummary, GradeSummary.key_id == Department.id)\
+     .filter(GradeSummary.scope == 'department')\
+     .group_by(Department.name)\
+     .having(db.func.sum(GradeSummary.count) > 0)\
+     .order_by(db.desc('avg_grade'))\
+     .first()
+
+    course_avg = session.query(
+        Course.name,
+        _average().label('avg_grade')
+    ).join(GradeSummary, GradeSummary.key_id == Course.id)\
+     .filter(GradeSummary.scope == 'course')\
+     .group_by(Course.name)\
+     .having(db.func.sum(GradeSummary.count) > 0)\
+     .order_by(db.desc('avg_grade'))\
+     .first()
+
+    return {
+        'average_grade': round(total / count, 2) if count else 0,
+        'top_department': dept_avg[0] if dept_avg else 'N/A',
+        'top_department_avg': round(dept_avg[1], 2) if dept_avg else 0,
+        'top_course': course_avg[0] if course_avg else 'N/A',
+        'top_course_avg': round(course_avg[1], 2) if course_avg else 0,
+        'at_risk_count': at_risk_count(at_risk_threshold)
+    }
+
+
+def summary_report(report_type, department_id=None, course_id=None, term_id=None):
+    """Answer a report from the summary tables
+
+    Returns None when the filter combination needs per-grade detail, in which
+    case the caller falls back to scanning the grade table.
+    """
+    session = read_session()
+    if report_type == 'grade_distribution':
+        if department_id and course_id:
+            return None
+        if department_id:
+            results = letter_distribution('department', department_id, term_id)
+        elif course_id:
+            results = letter_distribution('course', course_id, term_id)
+        else:
+            results = letter_distribution('term', None, term_id)
+        return pd.DataFrame(results, columns=['letter_grade', 'count'])
+
+    elif report_type == 'department_performance':
+        query = session.query(
+            Department.name.label('department'),
+            _average().label('average_grade')
+        ).join(GradeSummary, GradeSummary.key_id == Department.id)\
+         .filter(GradeSummary.scope == 'department')
+
+        # Students with at least one grade in scope, counted from their own summaries
+        students = session.query(
+            Department.name.label('department'),
+            db.func.count(db.func.distinct(GradeSummary.key_id)).label('student_count')
+        ).join(Student, Student.department_id == Department.id)\
+         .join(GradeSummary, GradeSummary.key_id == Student.id)\
+         .filter(GradeSummary.scope == 'student', GradeSummary.count > 0)
+
+        if term_id:
+            query = query.filter(GradeSummary.term_id == term_id)
+            students = students.filter(GradeSummary.term_id == term_id)
+
+        results = query.group_by(Department.name).having(db.func.sum(GradeSummary.count) > 0).all()
+        df = pd.DataFrame(results, columns=['department', 'average_grade'])
+        counts = pd.DataFrame(students.group_by(Department.name).all(), columns=['department', 'student_count'])
+        df = df.merge(counts, on='department', how='left')[['department', 'average_grade', 'student_count']]
+        df['student_count'] = df['student_count'].fillna(0).astype(int)
+        df['average_grade'] = df['average_grade'].round(2)
+
+        return df
+
+    elif report_type == 'course_comparison':
+        query = session.query(
+            Course.code.label('course_code'),
+            Course.name.label('course_name'),
+            _average().label('average_grade'),
+            db.func.sum(GradeSummary.count).label('enrollment')
+        ).join(GradeSummary, GradeSummary.key_id == Course.id)\
+         .filter(GradeSummary.scope == 'course')
+
+        if department_id:
+            query = query.filter(Course.department_id == department_id)
+        if term_id:
+            query = query.filter(GradeSummary.term_id == term_id)
+
+        results = query.group_by(Course.id).having(db.func.sum(GradeSummary.count) > 0).all()
+        df = pd.DataFrame(results, columns=['course_code', 'course_name', 'average_grade', 'enrollment'])
+        df['average_grade'] = df['average_grade'].round(2)
+
+        return df
+
+    elif report_type == 'term_trends':
+        if department_id and course_id:
+            return None
+        query = session.query(
+            Term.name.label('term'),
+            _average().label('average_grade')
+        ).join(GradeSummary, GradeSummary.term_id == Term.id)
+
+        if department_id:
+            query = query.filter(GradeSummary.scope == 'department', GradeSummary.key_id == department_id)
+        elif course_id:
+            query = query.filter(GradeSummary.scope == 'course', GradeSummary.key_id == course_id)
+        else:
+            query = query.filter(GradeSummary.scope == 'term')
+
+        results = query.group_by(Term.name).having(db.func.sum(GradeSummary.count) > 0)\
+            .order_by(Term.id).all()
+        df = pd.DataFrame(results, columns=['term', 'average_grade'])
+        df['average_grade'] = df['average_grade'].round(2)
+
+        return df
+
+    elif report_type in ('student_performance', 'at_risk_students'):
+        # at_risk_students ignores the course filter, like its grade table query
+        if course_id and report_type == 'student_performance':
+            return None
+        if report_type == 'at_risk_students':
+            # Range scan on the standing average index instead of grouping the summaries
+            results = at_risk_report(department_id, term_id)
+        else:
+            query = session.query(
+                Student.id,
+                Student.student_id,
+                Student.first_name,
+                Student.last_name,
+                Department.name.label('department'),
+                _average().label('average_grade')
+            ).join(GradeSummary, GradeSummary.key_id == Student.id)\
+             .join(Department, Department.id == Student.department_id)\
+             .filter(GradeSummary.scope == 'student')
+
+            if department_id:
+                query = query.filter(Student.department_id == department_id)
+            if term_id:
+                query = query.filter(GradeSummary.term_id == term_id)
+
+            query = query.group_by(Student.id).having(db.func.sum(GradeSummary.count) > 0)
+
+            results = query.all()
+        df = pd.DataFrame(results, columns=[
+            'id', 'student_id', 'first_name', 'last_name', 'department', 'average_grade'
+        ])
+        df['average_grade'] = df['average_grade'].round(2)
+        df['full_name'] = df['first_name'] + ' ' + df['last_name']
+
+        return df
+
+    return None
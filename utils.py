@@ -1,6 +1,24 @@
+import base64
+import json
 import pandas as pd
 import numpy as np
-from models import db, Student, Course, Grade, Department, Term
+from database import read_session
+from models import db, Student, Course, Grade, Department, Term, GradeSummary, calculate_gpas
+from grading import get_at_risk_threshold
+from summaries import letter_distribution, summary_report, summary_statistics
+from cache import cache, report_cache, MISSING
+from archive import archive
+from analytics import analytics, grade_slice, filter_grades, report_frame, student_gpas, REPORT_FILTERS
+
+# Columns returned by the grade table query of each report type
+REPORT_COLUMNS = {
+    'grade_distribution': ['letter_grade', 'count'],
+    'department_performance': ['department', 'average_grade', 'student_count'],
+    'course_comparison': ['course_code', 'course_name', 'average_grade', 'enrollment'],
+    'term_trends': ['term', 'average_grade'],
+    'student_performance': ['id', 'student_id', 'first_name', 'last_name', 'department', 'average_grade'],
+    'at_risk_students': ['id', 'student_id', 'first_name', 'last_name', 'department', 'average_grade']
+}
 
 def allowed_file(filename):
     """Check if file type is allowed"""
@@ -9,49 +27,219 @@ def allowed_file(filename):
 
 def calculate_statistics():
     """Calculate summary statistics for dashboard"""
-    # Overall GPA
-    avg_grade = db.session.query(db.func.avg(Grade.numeric_grade)).scalar() or 0
-    
-    # Department with highest average
-    dept_avg = db.session.query(
-        Department.name, 
-        db.func.avg(Grade.numeric_grade).label('avg_grade')
-    ).join(Student, Student.department_id == Department.id)\
-     .join(Grade, Grade.student_id == Student.id)\
-     .group_by(Department.name)\
-     .order_by(db.desc('avg_grade'))\
-     .first()
-    
-    # Course with highest average
-    course_avg = db.session.query(
-        Course.name,
-        db.func.avg(Grade.numeric_grade).label('avg_grade')
-    ).join(Grade, Grade.course_id == Course.id)\
-     .group_by(Course.name)\
-     .order_by(db.desc('avg_grade'))\
-     .first()
-    
-    # At-risk student count (below 70 average)
-    at_risk_count = db.session.query(db.func.count(db.func.distinct(Student.id)))\
-        .join(Grade, Grade.student_id == Student.id)\
-        .group_by(Student.id)\
-        .having(db.func.avg(Grade.numeric_grade) < 70)\
-        .count()
+    return cache.get_or_set('statistics', summary_statistics)
+
+def get_dashboard_data():
+    """Collect the dashboard payload, served from cache between imports"""
+    return cache.get_or_set('dashboard', _dashboard_data)
+
+def _dashboard_data():
+    # Recent grades are flattened so the payload can be cached outside a session
+    recent_grades = db.session.query(
+        Student.first_name, Student.last_name, Course.code,
+        Grade.numeric_grade, Grade.letter_grade, Grade.date_added
+    ).join(Student, Student.id == Grade.student_id)\
+     .join(Course, Course.id == Grade.course_id)\
+     .order_by(Grade.date_added.desc()).limit(5).all()
+    
+    # Get department distribution for chart
+    dept_data = _department_counts()
+    
+    # Grade distribution data
+    grade_distribution = letter_distribution()
+    
+    return {
+        'total_students': Student.query.count(),
+        'total_courses': Course.query.count(),
+        'recent_grades': [{
+            'student': {'full_name': f'{first_name} {last_name}'},
+            'course': {'code': code},
+            'numeric_grade': numeric_grade,
+            'letter_grade': letter_grade,
+            'date_added': date_added
+        } for first_name, last_name, code, numeric_grade, letter_grade, date_added in recent_grades],
+        'stats': calculate_statistics(),
+        'dept_labels': [x[0] for x in dept_data],
+        'dept_counts': [x[1] for x in dept_data],
+        'grade_labels': [x[0] for x in grade_distribution],
+        'grade_counts': [x[1] for x in grade_distribution]
+    }
+
+def _department_counts():
+    return db.session.query(Department.name, db.func.count(Student.id))\
+        .join(Student, Student.department_id == Department.id)\
+        .group_by(Department.name).all()
+
+def dashboard_snapshot():
+    """Dashboard figures pushed to live clients, computed without the cache"""
+    return {
+        'total_students': Student.query.count(),
+        'total_courses': Course.query.count(),
+        'stats': summary_statistics(),
+        'departments': {name: count for name, count in _department_counts()},
+        'grade_distribution': {letter: int(count) for letter, count in letter_distribution()}
+    }
+
+def _encode_cursor(row):
+    payload = json.dumps([row['last_name'], row['first_name'], row['id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        last_name, first_name, student_pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(last_name), str(first_name), int(student_pk)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def list_students(after=None, limit=20, department_id=None, search=None):
+    """Return one page of students ordered by name, using keyset pagination
+
+    after is the opaque cursor returned with the previous page. Only the
+    listed columns are loaded and the GPA comes from the grade summaries, so
+    every page costs the same regardless of how deep it is.
+    """
+    session = read_session()
+    gpa = session.query(
+        db.func.round(db.func.sum(GradeSummary.weighted_points) / db.func.sum(GradeSummary.credits), 2)
+    ).filter(GradeSummary.scope == 'student', GradeSummary.key_id == Student.id)\
+     .scalar_subquery()
+    
+    query = session.query(
+        Student.id,
+        Student.student_id,
+        Student.first_name,
+        Student.last_name,
+        Student.email,
+        Department.name.label('department'),
+        gpa.label('gpa')
+    ).join(Department, Department.id == Student.department_id)
+    
+    if department_id:
+        query = query.filter(Student.department_id == department_id)
+    if search:
+        # Prefix ranges instead of LIKE so the name and student id indexes apply
+        query = query.filter(db.or_(
+            db.and_(Student.last_name >= search, Student.last_name < search + '\uffff'),
+            db.and_(Student.student_id >= search, Student.student_id < search + '\uffff')
+        ))
+    if after:
+        query = query.filter(
+            db.tuple_(Student.last_name, Student.first_name, Student.id) > _decode_cursor(after)
+        )
+    
+    rows = query.order_by(Student.last_name, Student.first_name, Student.id)\
+        .limit(limit + 1).all()
+    students = [{
+        'id': row.id,
+        'student_id': row.student_id,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'full_name': f'{row.first_name} {row.last_name}',
+        'email': row.email,
+        'department': row.department,
+        'gpa': row.gpa or 0.0
+    } for row in rows[:limit]]
     
     return {
-        'average_grade': round(avg_grade, 2),
-        'top_department': dept_avg[0] if dept_avg else 'N/A',
-        'top_department_avg': round(dept_avg[1], 2) if dept_avg else 0,
-        'top_course': course_avg[0] if course_avg else 'N/A',
-        'top_course_avg': round(course_avg[1], 2) if course_avg else 0,
-        'at_risk_count': at_risk_count
+        'students': students,
+        'next_cursor': _encode_cursor(students[-1]) if len(rows) > limit else None
     }
 
+def get_report(report_type, department_id=None, course_id=None, term_id=None):
+    """Return generate_report output, cached per parameters and data version
+
+    The returned DataFrame is shared between requests and must not be modified.
+    """
+    return report_cache.get_or_create(
+        (report_type, department_id, course_id, term_id),
+        lambda: generate_report(report_type, department_id, course_id, term_id)
+    )
+
 def generate_report(report_type, department_id=None, course_id=None, term_id=None):
     """Generate report data based on parameters"""
+    return analytics.run(
+        report_type,
+        lambda: _sql_report(report_type, department_id, course_id, term_id),
+        department_id, course_id, term_id
+    )
+
+def _sql_report(report_type, department_id=None, course_id=None, term_id=None):
+    """Answer a report from the summary tables, scanning grades when they cannot"""
+    df = summary_report(report_type, department_id, course_id, term_id)
+    if df is None and report_type in REPORT_FILTERS and archive.covers(_archive_scope(report_type, term_id)):
+        # Archived grades are only in the term snapshots, which the grade table scan can't see
+        return generate_reports([report_type], department_id, course_id, term_id)[report_type]
+    if df is None:
+        df = _scan_report(report_type, department_id, course_id, term_id)
+    
+    if df is not None:
+        _add_gpa(df)
+    
+    return df
+
+def _archive_scope(report_type, term_id):
+    """The term a report reads grades from, or None when it spans every term"""
+    return term_id if 'term' in REPORT_FILTERS[report_type] else None
+
+def _add_gpa(df):
+    """Replace the student primary key column of a student report with GPAs"""
+    if 'id' in df:
+        student_pks = df.pop('id')
+        df['gpa'] = student_pks.map(calculate_gpas(student_pks.tolist()))
+
+def get_reports(report_types, department_id=None, course_id=None, term_id=None):
+    """Return {report type: DataFrame} for several reports sharing the same filters
+
+    Reports already cached are reused; the rest are derived from one shared
+    grade slice by generate_reports. The DataFrames must not be modified.
+    """
+    version = report_cache.data_version()
+    reports = {report_type: report_cache.get(('batch', report_type, department_id, course_id, term_id))
+               for report_type in report_types}
+    missing = [report_type for report_type, df in reports.items() if df is MISSING]
+    if missing:
+        for report_type, df in generate_reports(missing, department_id, course_id, term_id).items():
+            report_cache.set(('batch', report_type, department_id, course_id, term_id), df, version)
+            reports[report_type] = df
+    return reports
+
+def generate_reports(report_types, department_id=None, course_id=None, term_id=None):
+    """Generate several reports from a single fetch of the grade table
+
+    The slice is fetched with only the filters every requested report
+    honours; each report then applies its remaining filters in memory.
+    """
+    unknown = [report_type for report_type in report_types if report_type not in REPORT_FILTERS]
+    if unknown:
+        raise ValueError(f'Unknown report type: {", ".join(unknown)}')
+    
+    shared = set.intersection(*(set(REPORT_FILTERS[report_type]) for report_type in report_types))
+    student_reports = [report_type for report_type in report_types
+                       if report_type in ('student_performance', 'at_risk_students')]
+    grades, dimensions = grade_slice(department_id, course_id, term_id, tuple(shared),
+                                     students=bool(student_reports))
+    
+    gpas = None
+    if student_reports:
+        if analytics.enabled:
+            all_grades, _ = analytics.snapshot()
+            gpas = student_gpas(all_grades)
+        else:
+            # GPAs cover every grade of a student, not just the slice
+            gpas = pd.Series(calculate_gpas(grades['student_pk'].unique().tolist()), dtype=float)
+    
+    reports = {}
+    for report_type in report_types:
+        selected = filter_grades(grades, REPORT_FILTERS[report_type], department_id, course_id, term_id)
+        reports[report_type] = report_frame(report_type, selected, dimensions, gpas=gpas)
+    return reports
+
+def scan_report_query(report_type, department_id=None, course_id=None, term_id=None):
+    """Build the query that aggregates the grade table for a report"""
+    session = read_session()
     if report_type == 'grade_distribution':
         # Grade distribution report
-        query = db.session.query(
+        query = session.query(
             Grade.letter_grade,
             db.func.count(Grade.id).label('count')
         )
@@ -64,14 +252,11 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if term_id:
             query = query.filter(Grade.term_id == term_id)
             
-        results = query.group_by(Grade.letter_grade).all()
-        df = pd.DataFrame(results, columns=['letter_grade', 'count'])
-        
-        return df
+        return query.group_by(Grade.letter_grade)
         
     elif report_type == 'department_performance':
         # Department performance report
-        query = db.session.query(
+        query = session.query(
             Department.name.label('department'),
             db.func.avg(Grade.numeric_grade).label('average_grade'),
             db.func.count(db.func.distinct(Student.id)).label('student_count')
@@ -81,15 +266,11 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if term_id:
             query = query.filter(Grade.term_id == term_id)
             
-        results = query.group_by(Department.name).all()
-        df = pd.DataFrame(results, columns=['department', 'average_grade', 'student_count'])
-        df['average_grade'] = df['average_grade'].round(2)
-        
-        return df
+        return query.group_by(Department.name)
         
     elif report_type == 'course_comparison':
         # Course comparison report
-        query = db.session.query(
+        query = session.query(
             Course.code.label('course_code'),
             Course.name.label('course_name'),
             db.func.avg(Grade.numeric_grade).label('average_grade'),
@@ -101,15 +282,11 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if term_id:
             query = query.filter(Grade.term_id == term_id)
             
-        results = query.group_by(Course.id).all()
-        df = pd.DataFrame(results, columns=['course_code', 'course_name', 'average_grade', 'enrollment'])
-        df['average_grade'] = df['average_grade'].round(2)
-        
-        return df
+        return query.group_by(Course.id)
         
     elif report_type == 'term_trends':
         # Term trends report
-        query = db.session.query(
+        query = session.query(
             Term.name.label('term'),
             db.func.avg(Grade.numeric_grade).label('average_grade')
         ).join(Grade, Grade.term_id == Term.id)
@@ -120,15 +297,12 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if course_id:
             query = query.filter(Grade.course_id == course_id)
             
-        results = query.group_by(Term.name).order_by(Term.id).all()
-        df = pd.DataFrame(results, columns=['term', 'average_grade'])
-        df['average_grade'] = df['average_grade'].round(2)
-        
-        return df
+        return query.group_by(Term.name).order_by(Term.id)
         
     elif report_type == 'student_performance':
         # Student performance report
-        query = db.session.query(
+        query = session.query(
+            Student.id,
             Student.student_id,
             Student.first_name,
             Student.last_name,
@@ -144,18 +318,12 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if term_id:
             query = query.filter(Grade.term_id == term_id)
             
-        results = query.group_by(Student.id).all()
-        df = pd.DataFrame(results, columns=[
-            'student_id', 'first_name', 'last_name', 'department', 'average_grade'
-        ])
-        df['average_grade'] = df['average_grade'].round(2)
-        df['full_name'] = df['first_name'] + ' ' + df['last_name']
-        
-        return df
+        return query.group_by(Student.id)
         
     elif report_type == 'at_risk_students':
-        # At-risk students report (below 70 average)
-        query = db.session.query(
+        # At-risk students report (average below AT_RISK_THRESHOLD)
+        query = session.query(
+            Student.id,
             Student.student_id,
             Student.first_name,
             Student.last_name,
@@ -169,19 +337,70 @@ def generate_report(report_type, department_id=None, course_id=None, term_id=Non
         if term_id:
             query = query.filter(Grade.term_id == term_id)
             
-        # Having clause for students with average below 70
-        query = query.group_by(Student.id).having(db.func.avg(Grade.numeric_grade) < 70)
+        # Having clause for students with average below the threshold
+        return query.group_by(Student.id).having(db.func.avg(Grade.numeric_grade) < get_at_risk_threshold())
         
-        results = query.all()
-        df = pd.DataFrame(results, columns=[
-            'student_id', 'first_name', 'last_name', 'department', 'average_grade'
-        ])
+    return None
+
+def _scan_report(report_type, department_id=None, course_id=None, term_id=None):
+    """Generate report data by aggregating the grade table directly"""
+    query = scan_report_query(report_type, department_id, course_id, term_id)
+    if query is None:
+        return None
+    
+    return _finish_scan_rows(query.all(), report_type)
+
+def _finish_scan_rows(rows, report_type):
+    """Shape raw grade table query rows into a report DataFrame"""
+    df = pd.DataFrame(rows, columns=REPORT_COLUMNS[report_type])
+    if 'average_grade' in df:
         df['average_grade'] = df['average_grade'].round(2)
+    if 'first_name' in df:
         df['full_name'] = df['first_name'] + ' ' + df['last_name']
-        
-        return df
-        
-    return None
+    
+    return df
+
+def iter_report_batches(report_type, department_id=None, course_id=None, term_id=None, batch_size=5000):
+    """Yield a report as DataFrame batches
+
+    A report already in report_cache, e.g. because it was just viewed, is
+    sliced from the cached frame. Otherwise it is read from a streaming
+    cursor with only one batch in memory at a time, so exports of very large
+    reports use bounded memory and can start sending data immediately.
+    """
+    report = report_cache.get((report_type, department_id, course_id, term_id))
+    if report is MISSING and report_type in REPORT_FILTERS \
+            and archive.covers(_archive_scope(report_type, term_id)):
+        # Grades of archived terms are not in the grade table, so the report is built whole
+        report = get_report(report_type, department_id, course_id, term_id)
+    if report is not MISSING:
+        if report is None:
+            return
+        # Slices share the cached frame, so they are never modified
+        for start in range(0, max(len(report), 1), batch_size):
+            yield report.iloc[start:start + batch_size]
+        return
+    
+    query = scan_report_query(report_type, department_id, course_id, term_id)
+    if query is None:
+        return
+    
+    result = query.session.execute(query.statement, execution_options={'yield_per': batch_size})
+    empty = True
+    try:
+        for rows in result.partitions():
+            empty = False
+            df = _finish_scan_rows(rows, report_type)
+            _add_gpa(df)
+            yield df
+    finally:
+        result.close()
+    
+    # Always yield one frame so writers can emit the header of an empty report
+    if empty:
+        df = _finish_scan_rows([], report_type)
+        _add_gpa(df)
+        yield df
 
 def get_performance_trend(course_id=None, department_id=None):
     """Get performance trend data for visualization"""
@@ -0,0 +1,269 @@
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+REQUIRED_COLUMNS = ('student_id', 'course_code', 'grade')
+ERROR_COLUMNS = ['row', 'column', 'value', 'error']
+GRADE_RANGE = (0.0, 100.0)
+DEFAULT_CREDITS = 3.0
+EMAIL_DOMAIN = 'university.edu'
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+
+# Bytes read to estimate the line length when splitting a CSV
+SAMPLE_BYTES = 64 * 1024
+
+
+def _text(df, column, whitespace=None, upper=False):
+    """Stripped text of an upload column, with blanks as missing values
+
+    Uploads repeat the same ids, codes and names on many rows, so the string
+    work runs once per distinct value. With whitespace given, runs of
+    whitespace inside the text are replaced by it.
+    """
+    if column not in df:
+        return pd.Series(pd.NA, index=df.index, dtype='string')
+    series = df[column]
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        # Spreadsheets hand back numeric ids as floats
+        series = series.astype('Int64')
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(uniques, dtype='string').str.strip()
+    if whitespace is not None:
+        text = text.str.replace(r'\s+', whitespace, regex=True)
+    if upper:
+        text = text.str.upper()
+    # Missing values have code -1, which picks the NA appended at the end
+    text = pd.concat([text.mask(text == ''), pd.Series([pd.NA], dtype='string')], ignore_index=True)
+    return pd.Series(text.to_numpy()[codes], index=df.index, dtype='string')
+
+
+def _number(df, column, text):
+    """Numeric values of an upload column, NaN where the text is not a number"""
+    if column in df and pd.api.types.is_numeric_dtype(df[column]):
+        return df[column].astype(float)
+    return pd.to_numeric(text.astype(object), errors='coerce').astype(float)
+
+
+def _matches(text, pattern):
+    """Whether each value matches pattern, testing every distinct value once"""
+    codes, uniques = pd.factorize(text)
+    matched = pd.Series(uniques, dtype='string').str.match(pattern).fillna(False).to_numpy(dtype=bool)
+    return pd.Series((codes >= 0) & matched[codes], index=text.index)
+
+
+def _error_frame(mask, column, values, message):
+    """Error records for the rows flagged in mask"""
+    return pd.DataFrame({
+        'row': mask.index[mask.to_numpy()],
+        'column': column,
+        'value': values[mask].astype('string').fillna('').to_numpy(),
+        'error': message
+    }, columns=ERROR_COLUMNS)
+
+
+def validate_frame(df):
+    """Coerce and check one chunk of an upload
+
+    Text is stripped, course codes lose inner whitespace and are upper-cased
+    and department and course names have runs of whitespace collapsed. Emails default to
+    <student_id>@university.edu. Returns the clean rows (in the columns the
+    importer expects) and a frame of errors, one per failing field, whose
+    row is the position of the row in df.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df]
+    if missing:
+        raise ValueError(f'Missing required column(s): {", ".join(missing)}')
+    df = df.reset_index(drop=True)
+
+    student_id = _text(df, 'student_id')
+    course_code = _text(df, 'course_code', whitespace='', upper=True)
+    raw_grade = _text(df, 'grade')
+    grade = _number(df, 'grade', raw_grade)
+    email = _text(df, 'email')
+    email = email.fillna(student_id[email.isna()] + '@' + EMAIL_DOMAIN)
+    raw_credits = _text(df, 'credits')
+    credits = _number(df, 'credits', raw_credits)
+
+    low, high = GRADE_RANGE
+    checks = [
+        (student_id.isna(), 'student_id', student_id, 'student_id is required'),
+        (course_code.isna(), 'course_code', course_code, 'course_code is required'),
+        (raw_grade.isna(), 'grade', raw_grade, 'grade is required'),
+        (raw_grade.notna() & grade.isna(), 'grade', raw_grade, 'grade is not a number'),
+        (grade.notna() & ((grade < low) | (grade > high)), 'grade', raw_grade,
+         f'grade must be between {low:g} and {high:g}'),
+        (student_id.notna() & ~_matches(email, EMAIL_PATTERN), 'email', email, 'email is not a valid address'),
+        (raw_credits.notna() & (credits.isna() | (credits <= 0)), 'credits', raw_credits,
+         'credits must be a positive number')
+    ]
+    errors = pd.concat([_error_frame(mask.fillna(False).astype(bool), column, values, message)
+                        for mask, column, values, message in checks], ignore_index=True)
+
+    frame = pd.DataFrame({
+        'student_id': student_id.astype(object),
+        'course_code': course_code.astype(object),
+        'grade': grade,
+        'department': _text(df, 'department', whitespace=' ').astype(object),
+        'first_name': _text(df, 'first_name').astype(object),
+        'last_name': _text(df, 'last_name').astype(object),
+        'email': email.astype(object),
+        'course_name': _text(df, 'course_name', whitespace=' ').fillna(course_code).astype(object),
+        'credits': credits.fillna(DEFAULT_CREDITS)
+    })
+    return frame.drop(index=errors['row'].unique()), errors.sort_values('row', kind='stable', ignore_index=True)
+
+
+def iter_grade_chunks(filepath, chunk_size):
+    """Yield DataFrame chunks of at most chunk_size rows from a grade file"""
+    extension = filepath.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        # Keep identifiers as text so every chunk resolves them the same way
+        yield from pd.read_csv(filepath, chunksize=chunk_size,
+                               dtype={'student_id': str, 'course_code': str})
+    elif extension == 'xlsx':
+        yield from _iter_xlsx_chunks(filepath, chunk_size)
+    elif extension == 'xls':
+        # Legacy .xls has no streaming reader, so the sheet is loaded once
+        df = pd.read_excel(filepath, dtype={'student_id': str, 'course_code': str})
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+    else:
+        raise ValueError('Unsupported file format')
+
+
+def _iter_xlsx_chunks(filepath, chunk_size):
+    """Read the first worksheet of an .xlsx file in row batches"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def _validate_chunk(df):
+    """Process pool task: validate a chunk read by the parent"""
+    clean, errors = validate_frame(df)
+    return clean, errors, len(df)
+
+
+def _validate_csv_range(filepath, start, end, header):
+    """Process pool task: parse and validate the CSV lines in a byte range"""
+    with open(filepath, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=header,
+                     dtype={'student_id': str, 'course_code': str})
+    return _validate_chunk(df)
+
+
+def _csv_ranges(filepath, chunk_size):
+    """Split a CSV without quoted fields into line-aligned byte ranges
+
+    Returns (header, ranges), or None when the file has quotes, since a
+    quoted field may span lines and only a sequential reader can split it.
+    """
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b''):
+            if b'"' in block:
+                return None
+        handle.seek(0)
+        header_line = handle.readline()
+        body_start = handle.tell()
+        sample = handle.read(SAMPLE_BYTES)
+        lines = sample.count(b'\n')
+        line_bytes = len(sample) / lines if lines else max(len(sample), 1)
+        step = max(int(line_bytes * chunk_size), 1)
+
+        header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+        header = [name.strip() for name in header]
+        ranges = []
+        start = body_start
+        while start < size:
+            handle.seek(min(start + step, size))
+            handle.readline()
+            end = min(handle.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def validate_file(filepath, chunk_size, workers=1, max_in_flight=None):
+    """Yield (clean frame, errors, row count) for each chunk of a grade file, in file order
+
+    With more than one worker, chunks are parsed and validated in a process
+    pool: a CSV without quoted fields is split into byte ranges that workers
+    read themselves, while other files are read here and only validated in
+    the pool. At most max_in_flight chunks (twice the workers by default)
+    are pending at once, so memory stays bounded on large files. Error rows
+    are numbered like a spreadsheet, the header being row 1.
+    """
+    extension = filepath.rsplit('.', 1)[-1].lower()
+    split = _csv_ranges(filepath, chunk_size) if extension == 'csv' and workers > 1 else None
+    if split is not None:
+        header, ranges = split
+        tasks = ((_validate_csv_range, filepath, start, end, header) for start, end in ranges)
+    else:
+        tasks = ((_validate_chunk, chunk) for chunk in iter_grade_chunks(filepath, chunk_size))
+
+    offset = 0
+    if workers <= 1 or (split is not None and len(split[1]) <= 1):
+        results = (task(*args) for task, *args in tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = _ordered_results(pool, tasks, max_in_flight or workers * 2)
+    try:
+        for clean, errors, rows in results:
+            errors['row'] += offset + 2
+            clean.index += offset
+            offset += rows
+            yield clean, errors, rows
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _ordered_results(pool, tasks, max_in_flight):
+    """Submit tasks with a bounded number in flight and yield results in submission order"""
+    pending = deque()
+    for task, *args in tasks:
+        pending.append(pool.submit(task, *args))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ErrorReport:
+    """Append validation errors to a CSV file, created on the first error"""
+
+    def __init__(self, path):
+        self.path = path
+        self.errors = 0
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def write(self, errors):
+        if not self.path or errors.empty:
+            return
+        first = self.errors == 0
+        if first:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        errors.to_csv(self.path, mode='w' if first else 'a', header=first, index=False)
+        self.errors += len(errors)